@@ -1,144 +1,370 @@
-from openai import OpenAI
-from dotenv import load_dotenv
 from prompt import prompt, sys_msg
-from write_doc import auth_docs, build_requests_from_html
+import argparse
 import os
-import time
-from post import post_to_wp
+from functools import partial
+from types import SimpleNamespace
+from store import OUTPUT_PATTERN, open_store, read_location
+from templates import compile_prompt
+from journal import Journal
+from retry import RetryPolicy
+from metrics import default_metrics as metrics
+from manifest import Job, in_shard, parse_shard, read_manifest, shard_path
+from validate import PageValidator
+# the LLM, Docs and WordPress modules (and asyncio, openai, the Google client,
+# requests behind them) are imported by the stage that uses them, so --help,
+# a docs-only or wp-only run and every worker process skip the rest
 
 # standard environment variable name for OpenAI API key -- OPENAI_API_KEY
+API_KEY_ENV_VAR = "OPENAI_API_KEY"
 
-load_dotenv()   
-
-client = OpenAI()
-
-API_KEY_ENV_VAR = "OPENAI_API_KEY"  
-MODEL = "gpt-4.1-nano"
-OUTPUT_DIR = "."
-MAX_TOKENS = 2500
-# max_completion_tokens = 2500
-
-# USERNAME = os.getenv("WP_USERNAME")
-# APP_PASSWORD = os.getenv("WP_APP_PASSWORD")
-# WP_URL = os.getenv("WP_URL")
-# featured_img_url = os.getenv("FEATURED_IMAGE_URL")
-# social_image = os.getenv("SOCIAL_IMAGE_URL")
-# country_name = os.getenv("COUNTRY_NAME")
-# category_name = os.getenv("CATEGORY_NAME")
-# page_title = os.getenv("page_title_format")
-# key_phrase = os.getenv("key_phrase_format")
-# description = os.getenv("description_format")
-# brand_name = os.getenv("BRAND_NAME")
-# print(WP_URL)
-
-'''
-docs_service = auth_docs()
-doc_id = '1J43gRLDYKC8q6EZfQGuOUbarbcDblaF2Jwr-zbpz44M'
-
-doc = docs_service.documents().get(documentId=doc_id, includeTabsContent=True).execute()
-
-tabs = doc.get("tabs", [])
-print("Tabs in document:", [tab["tabProperties"]["title"] for tab in tabs])
-
-if not tabs:
-    raise Exception("No tabs found in the document")
-tab_dict = {}
-for t in tabs:
-    tab_title = t["tabProperties"]["title"]
-    tab_id = t["tabProperties"]["tabId"]
-    
-    if not tab_title in tab_dict.keys():
-        tab_dict[tab_title] = tab_id
-
-    # print("Tab title:", t["tabProperties"]["title"], "ID:", t["tabProperties"]["tabId"])
-print(tab_dict)
-
-
-cities = [tab["tabProperties"]["title"] for tab in tabs] '''
-# city_name = "Mumbai"
-
-cities = ["Chennai"]
-
-prompt_template = prompt
-
-for city_name in cities:
-    s_time = time.time()
-    print(f"\n=== Generating content for city: {city_name} ===\n")
-    time.sleep(10)
-    country_name = "India"
-    # prompt = build_prompt(city)
-    filename_safe = city_name.lower().replace(" ", "_")
-    output_path = os.path.join(OUTPUT_DIR, f"{filename_safe}_seo_page3.txt")
-
-    # Basic retry/backoff in case of transient failures
-    max_retries = 1
-    backoff = 5.0
-
-    final_prompt = prompt_template.format(city_name=city_name, country_name=country_name)
-     
-    for attempt in range(1, max_retries + 1):
-        try:
-            print(f"[Attempt {attempt}] Calling model to generate content for {city_name}...")
-            time.sleep(40)
-            response = client.chat.completions.create(
-                model=MODEL,
-                messages=[
-                    {"role": "system", "content": sys_msg},
-                    {"role": "user", "content": final_prompt}
-                ],
-                max_tokens=MAX_TOKENS,
-                # max_completion_tokens=MAX_TOKENS
-                temperature=0.5  
-            )
-            
-            choices = response.choices or []  # Extract content
-
-            if not choices:
-                raise RuntimeError("API returned no choices; retrying.")
-
-            content = choices[0].message.content
-            # Basic validation: ensure we have at least 5000 characters 
-            if not content  or len(content) < 5000:
-                print("Warning: generated content seems short; retrying once.")
-                raise RuntimeError("Generated content too short.")
-            else:
-                print('----Content generated----')
-                e_time = time.time()
-                # print(e_time - s_time)
-                usage = response.usage or {}
-                print(f'Usage: {usage}')
-            
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(content)
-                print('++++written to file++++')
-                time.sleep(10)
-            
-            # tab_id = tab_dict[city_name]
-            # requests = build_requests_from_html(content, tab_id=tab_id)
- 
-            # if not requests:
-            #     print("No requests generated.")
-            #     return
-
-            # Send batchUpdate
-            # batch = {"requests": requests}
-            # docs_service.documents().batchUpdate(documentId=doc_id, body=batch).execute()
-
-            # print("Batch update executed.")
-            # print(f"Open the doc tab {city_name} with id : {tab_id} in Google Drive to review formatting.")
-            # time.sleep(10)
-
-            # print(f"✅ Generated content saved to: {output_path}")
-
-            # response = post_to_wp(content, featured_img_url, page_title, brand_name, key_phrase, description, social_image, WP_URL, USERNAME, APP_PASSWORD)
-            # print(f"✅ Generated content posted to WordPress for city: {city_name}")
-            # if response.status_code == 201:
-            #     page_url = response.json().get("link", "")
-            #     print(f"✅ Created page for '{city_name}': {page_url}")
-
-        except Exception as e:
-            print(f"Error on attempt {attempt}: {e}")
-            if attempt == max_retries:
-                raise
-            else:
-                time.sleep(backoff * attempt)
\ No newline at end of file
+
+def load_settings():
+    """Read .env and the environment; main() calls it, so importing app has no side effects."""
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    env = os.getenv
+    return SimpleNamespace(
+        output_dir=env("OUTPUT_DIR", "."),
+        # page file name inside OUTPUT_DIR, takes {city_slug} and {city_name}
+        output_pattern=env("OUTPUT_PATTERN", OUTPUT_PATTERN),
+        # "" keeps one file per city in OUTPUT_DIR; a path like pages.sqlite keeps every
+        # page (and every rerun of it, as a new version) compressed in one SQLite file
+        output_store=env("OUTPUT_STORE", ""),
+        # pages of different runs never overwrite each other in OUTPUT_STORE
+        run_id=env("RUN_ID", "main"),
+        max_tokens=int(env("MAX_TOKENS", "2500")),
+        temperature=float(env("TEMPERATURE", "0.5")),
+        # refuse requests whose prompt is longer than this many tokens; 0 = only the model's context window
+        max_prompt_tokens=int(env("MAX_PROMPT_TOKENS", "0")),
+        # "1" = send the whole prompt template first and the city/country after it, so every
+        # request shares one long cacheable prefix (rewords the prompt; cached pages won't match)
+        prompt_static_first=env("PROMPT_STATIC_FIRST", "0") == "1",
+        # page checks; pages failing only in the h1, the sections, the length or the FAQ
+        # get just that part requested again instead of the whole page
+        validate=env("VALIDATE", "1") == "1",
+        min_content_chars=int(env("MIN_CONTENT_CHARS", "5000")),
+        min_h2=int(env("MIN_H2", "3")),
+        require_faq=env("REQUIRE_FAQ", "1") == "1",
+        min_links=int(env("MIN_LINKS", "0")),
+        # city mentions per 100 words, "min,max"; "" turns the check off
+        city_density=env("CITY_DENSITY", "0.2,5"),
+        # pages this similar (estimated Jaccard of their 5-word shingles, city name
+        # masked) to an earlier page are near duplicates; 0 turns the check off
+        dedup_threshold=float(env("DEDUP_THRESHOLD", "0.8")),
+        # regenerations of a near duplicate before it is kept and flagged in the journal
+        dedup_regenerate=int(env("DEDUP_REGENERATE", "1")),
+        # signatures of the pages seen so far, one file per shard (each shard only checks
+        # its own cities); "" rebuilds them from the stored pages each run
+        dedup_index=env("DEDUP_INDEX", "dedup_index.sqlite"),
+        # default for manifest rows without a country
+        country_name=env("COUNTRY_NAME", "India"),
+        # CSV / JSONL / YAML job list with city, country, tab, doc_id, page_title, key_phrase, description
+        manifest=env("MANIFEST"),
+
+        # "async" sends many cities at once, "sync" one at a time through the first provider,
+        # "batch" submits everything to the Batch API (cheaper, results within 24h)
+        gen_mode=env("GEN_MODE", "async"),
+        # requests in flight per provider to start with; they grow while the provider keeps
+        # up (up to MAX_CONCURRENCY, default 4x) and halve on a 429
+        concurrency=int(env("CONCURRENCY", "8")),
+        max_concurrency=int(env("MAX_CONCURRENCY", "0")) or None,
+        # LLM providers, e.g. "openai,deepseek"; each takes <NAME>_MODEL, <NAME>_BASE_URL,
+        # <NAME>_CONCURRENCY, <NAME>_MAX_CONCURRENCY, <NAME>_RPM, <NAME>_TPM and <NAME>_WEIGHT
+        # (OPENAI_RPM=500 ...), or use a JSON file. RPM/TPM are only where pacing starts, the
+        # limits the API reports in its x-ratelimit-* headers replace them after the first response.
+        # Account limits: https://platform.openai.com/settings/organization/limits
+        llm_providers=env("LLM_PROVIDERS", "openai"),
+        llm_providers_file=env("LLM_PROVIDERS_FILE"),
+        # "weight" spreads requests by <NAME>_WEIGHT, "cost" tries the cheapest model first
+        llm_routing=env("LLM_ROUTING", "weight"),
+        batch_input=env("BATCH_INPUT", "batch_requests.jsonl"),
+        batch_output=env("BATCH_OUTPUT", "batch_output.jsonl"),
+        batch_poll_interval=int(env("BATCH_POLL_INTERVAL", "60")),
+        # on-disk response cache; set LLM_CACHE="" to always call the API
+        llm_cache=env("LLM_CACHE", "llm_cache.sqlite"),
+        llm_cache_max_mb=int(env("LLM_CACHE_MAX_MB", "500")),
+        llm_cache_max_age_days=int(env("LLM_CACHE_MAX_AGE_DAYS", "30")),
+        # per city / per stage progress log; delete the file to start a job from scratch
+        job_journal=env("JOB_JOURNAL", "job_journal.jsonl"),
+        max_attempts=int(env("MAX_ATTEMPTS", "4")),
+        # stream pages to disk as they are generated and stop early on bad openings
+        stream=env("STREAM", "0") == "1",
+
+        # WordPress stage: set WP_URL to post every written page
+        wp_username=env("WP_USERNAME"),
+        wp_app_password=env("WP_APP_PASSWORD"),
+        wp_url=env("WP_URL"),
+        featured_img_url=env("FEATURED_IMAGE_URL"),
+        social_image=env("SOCIAL_IMAGE_URL"),
+        # formats take {city_name} and {country_name}
+        page_title=env("page_title_format", "{city_name}"),
+        key_phrase=env("key_phrase_format", "{city_name}"),
+        description=env("description_format", ""),
+        brand_name=env("BRAND_NAME"),
+        wp_workers=int(env("WP_WORKERS", "8")),
+        # "1" = update pages that already exist (matched by slug) and skip unchanged ones
+        wp_upsert=env("WP_UPSERT", "0") == "1",
+        wp_index=env("WP_INDEX", "wp_index.json"),
+        wp_index_max_age=int(env("WP_INDEX_MAX_AGE", "3600")),
+
+        # Docs requests and WordPress bodies are built on a process pool when at least
+        # POSTPROCESS_MIN_PAGES pages are due; 0 workers = one per CPU
+        postprocess_workers=int(env("POSTPROCESS_WORKERS", "0")),
+        postprocess_min_pages=int(env("POSTPROCESS_MIN_PAGES", "50")),
+        # built pages waiting for each I/O stage
+        postprocess_queue=int(env("POSTPROCESS_QUEUE", "64")),
+
+        # Google Docs stage: set DOCS_DOC_ID to write each page into the tab named after its city
+        docs_doc_id=env("DOCS_DOC_ID"),
+        docs_workers=int(env("DOCS_WORKERS", "4")),
+        # "1" = take the city list from the tab titles of DOCS_DOC_ID
+        cities_from_tabs=env("CITIES_FROM_TABS", "0") == "1",
+        # per-stage timings, tokens and cost of the run; "" skips that file
+        run_metrics_json=env("RUN_METRICS_JSON", "run_metrics.json"),
+        run_metrics_csv=env("RUN_METRICS_CSV", "run_metrics.csv"),
+    )
+
+
+# used when there is no manifest and no --city
+DEFAULT_CITIES = ["Chennai"]
+STAGES = ("generate", "docs", "wp")
+
+
+def build_parser(settings):
+    parser = argparse.ArgumentParser(description="Generate city landing pages and publish them to Google Docs and WordPress.")
+    parser.add_argument("manifest", nargs="?", default=settings.manifest,
+                        help="CSV, JSONL or YAML job list (columns: city, country, tab, doc_id, page_title, "
+                             "key_phrase, description); env MANIFEST")
+    parser.add_argument("--city", action="append", dest="cities", metavar="CITY", help="add a city (repeatable)")
+    parser.add_argument("--country", default=settings.country_name, help="country for jobs without one")
+    parser.add_argument("--shard", metavar="i/N",
+                        help="only run the cities of shard i (0-based) of N; every city is in exactly one shard")
+    parser.add_argument("--stages", default=",".join(STAGES), help=f"comma-separated subset of {','.join(STAGES)}")
+    parser.add_argument("--mode", choices=("async", "sync", "batch"), default=settings.gen_mode)
+    parser.add_argument("--stream", action="store_true", default=settings.stream)
+    parser.add_argument("--max-tokens", type=int, default=settings.max_tokens)
+    parser.add_argument("--temperature", type=float, default=settings.temperature)
+    parser.add_argument("--output-dir", default=settings.output_dir)
+    parser.add_argument("--output-pattern", default=settings.output_pattern)
+    parser.add_argument("--store", default=settings.output_store,
+                        help="SQLite file to keep pages in instead of .txt files")
+    parser.add_argument("--run-id", default=settings.run_id, help="name of this run's pages in --store")
+    parser.add_argument("--journal", default=settings.job_journal)
+    parser.add_argument("--docs-doc-id", default=settings.docs_doc_id, help="document for jobs without a doc_id")
+    parser.add_argument("--cities-from-tabs", action="store_true", default=settings.cities_from_tabs,
+                        help="take the jobs from the tab titles of --docs-doc-id")
+    parser.add_argument("--wp-url", default=settings.wp_url)
+    parser.add_argument("--wp-upsert", action="store_true", default=settings.wp_upsert)
+    return parser
+
+
+def load_jobs(args, docs_publisher=None):
+    """Jobs from the manifest, --city, the Docs tabs or DEFAULT_CITIES, first one per city only."""
+    if args.manifest:
+        jobs = read_manifest(args.manifest)
+    elif args.cities:
+        jobs = (Job(city) for city in args.cities)
+    elif args.cities_from_tabs and docs_publisher:
+        jobs = (Job(title, tab=title) for title in docs_publisher.tabs(args.docs_doc_id))
+    else:
+        jobs = (Job(city) for city in DEFAULT_CITIES)
+
+    seen = set()
+    for job in jobs:
+        # the journal and the page files are keyed by city
+        if job.city in seen:
+            print(f"⚠️ Duplicate city {job.city!r} in the job list, keeping the first")
+            continue
+        seen.add(job.city)
+        yield job
+
+
+def wp_due(job, args, journal):
+    # upserts compare content hashes instead, so changed pages are sent again
+    return journal.done(job.city, "written") and (args.wp_upsert or not journal.done(job.city, "wp-posted"))
+
+
+def docs_due(job, args, journal):
+    return bool(job.doc_id or args.docs_doc_id) and journal.done(job.city, "written") \
+        and not journal.done(job.city, "docs-updated")
+
+
+def wp_fields(job, args, settings):
+    """(page_title, key_phrase, description) of a job, from the manifest or the env formats."""
+    fields = {"city_name": job.city, "country_name": job.country or args.country}
+    return (job.page_title or settings.page_title.format(**fields),
+            job.key_phrase or settings.key_phrase.format(**fields),
+            job.description or settings.description.format(**fields))
+
+
+def wp_pages(jobs, args, journal, store, settings):
+    # generator, and pages are read by the workers, so only the pages in flight are held in memory
+    for job in jobs:
+        if not wp_due(job, args, journal):
+            continue
+        title, phrase, desc = wp_fields(job, args, settings)
+        yield {
+            "key": job.city,
+            "html_content": partial(store.get, job.city),
+            "page_title": title,
+            "key_phrase": phrase,
+            "description": desc,
+        }
+
+
+def post_jobs(jobs, args, journal, store, settings, docs, wp):
+    """PostJobs for the pages still due in the Docs and/or WordPress stage."""
+    from postprocess import PostJob
+
+    for job in jobs:
+        doc_id = (job.doc_id or args.docs_doc_id) if docs and docs_due(job, args, journal) else None
+        fields = wp_fields(job, args, settings) if wp and wp_due(job, args, journal) else None
+        if doc_id or fields:
+            yield PostJob(job.city, store.location(job.city), doc_id, job.tab, fields)
+
+
+def build_validator(settings):
+    if not settings.validate:
+        return None
+    density = None
+    if settings.city_density:
+        density = tuple(float(value) if value.strip() else None for value in settings.city_density.split(","))
+    return PageValidator(min_chars=settings.min_content_chars, min_h2=settings.min_h2,
+                         require_faq=settings.require_faq, min_links=settings.min_links, city_density=density)
+
+
+def build_dedup(settings, store, cities, path):
+    if not settings.dedup_threshold:
+        return None
+    from dedup import DedupIndex
+
+    dedup = DedupIndex(settings.dedup_threshold, path=path or None)
+    # pages written by earlier runs that are not in the index yet
+    for city_name, match in dedup.update(store, cities).items():
+        print(f"⚠️ Stored page of {city_name} is {match.similarity:.0%} similar to {match.key}")
+    return dedup
+
+
+def main(argv=None):
+    settings = load_settings()
+    parser = build_parser(settings)
+    args = parser.parse_args(argv)
+    stages = {stage.strip() for stage in args.stages.split(",") if stage.strip()}
+    if stages - set(STAGES):
+        parser.error(f"unknown stages: {sorted(stages - set(STAGES))}")
+    if args.cities_from_tabs and not args.docs_doc_id:
+        parser.error("--cities-from-tabs needs --docs-doc-id (or DOCS_DOC_ID)")
+    try:
+        shard_index, shard_count = parse_shard(args.shard) if args.shard else (0, 1)
+    except ValueError as e:
+        parser.error(str(e))
+    # shards may run side by side in one directory, so each keeps its own state files
+    journal = Journal(shard_path(args.journal, shard_index, shard_count))
+    retry_policy = RetryPolicy(max_attempts=settings.max_attempts)
+
+    docs_publisher = None
+    if "docs" in stages or args.cities_from_tabs:
+        from docs_publisher import DocsPublisher
+        docs_publisher = DocsPublisher(workers=settings.docs_workers, retry_policy=retry_policy, journal=journal)
+
+    # the manifest is read as a stream; only this shard's jobs are kept
+    jobs = list(in_shard(load_jobs(args, docs_publisher), shard_index, shard_count))
+    print(f"{len(jobs)} cities in shard {shard_index}/{shard_count}")
+    cities = [job.city for job in jobs]
+    countries = {job.city: job.country for job in jobs if job.country}
+    store = open_store(args.store, args.output_dir, args.output_pattern, args.run_id)
+
+    if "generate" in stages:
+        from cache import ResponseCache
+        from providers import load_providers
+
+        defaults = {"concurrency": settings.concurrency, "max_concurrency": settings.max_concurrency}
+        providers, routing = load_providers(settings.llm_providers_file, settings.llm_providers, defaults=defaults)
+        # the first provider names the model and serves the sync and batch modes
+        model = providers[0].model
+        # parsed once here; its static prefix is what the provider can cache between cities
+        compiled = compile_prompt(prompt, sys_msg, settings.prompt_static_first)
+        validator = build_validator(settings)
+        dedup = build_dedup(settings, store, cities, shard_path(settings.dedup_index, shard_index, shard_count))
+        cache = None
+        if settings.llm_cache:
+            cache = ResponseCache(settings.llm_cache, max_bytes=settings.llm_cache_max_mb * 1024 * 1024,
+                                  max_age=settings.llm_cache_max_age_days * 24 * 3600)
+
+        if args.mode == "batch":
+            from batch import run_batch
+
+            run_batch(providers[0].sync_client(), cities, args.country, compiled, sys_msg, model, args.max_tokens,
+                      store, temperature=args.temperature,
+                      input_path=shard_path(settings.batch_input, shard_index, shard_count),
+                      download_path=shard_path(settings.batch_output, shard_index, shard_count),
+                      poll_interval=settings.batch_poll_interval, cache=cache, journal=journal, countries=countries,
+                      max_prompt_tokens=settings.max_prompt_tokens, validator=validator, dedup=dedup)
+        else:
+            import asyncio
+            from engine import Engine
+            from providers import Router
+
+            if args.mode == "sync":
+                # the same pipeline, one city at a time through the first provider
+                providers = providers[:1]
+                providers[0].concurrency = providers[0].max_concurrency = 1
+            router = Router(providers, routing or settings.llm_routing)
+            engine = Engine(None, compiled, sys_msg, model, args.max_tokens, store,
+                            temperature=args.temperature, concurrency=router.concurrency,
+                            retry_policy=retry_policy, cache=cache, journal=journal, stream=args.stream,
+                            router=router, max_prompt_tokens=settings.max_prompt_tokens, validator=validator,
+                            dedup=dedup, dedup_regenerate=settings.dedup_regenerate)
+            asyncio.run(engine.run(cities, args.country, countries))
+        if dedup:
+            dedup.close()
+        if cache:
+            cache.close()
+
+    wp_publisher = None
+    if "wp" in stages and args.wp_url:
+        from post import WordPressPublisher
+        wp_publisher = WordPressPublisher(args.wp_url, settings.wp_username, settings.wp_app_password,
+                                          featured_img_url=settings.featured_img_url,
+                                          social_image=settings.social_image, brand_name=settings.brand_name,
+                                          workers=settings.wp_workers,
+                                          retry_policy=retry_policy, journal=journal, upsert=args.wp_upsert,
+                                          index_path=shard_path(settings.wp_index, shard_index, shard_count),
+                                          index_max_age=settings.wp_index_max_age)
+    docs = "docs" in stages
+    # pages are read back from the store, so this also picks up pages written by earlier runs
+    due = list(post_jobs(jobs, args, journal, store, settings, docs, wp_publisher is not None))
+
+    wp_results = []
+    if len(due) >= settings.postprocess_min_pages:
+        # parse on every core, publish from the queues as pages come out
+        from postprocess import PostProcessor
+        processor = PostProcessor(docs_publisher if docs else None, wp_publisher,
+                                  workers=settings.postprocess_workers, queue_size=settings.postprocess_queue)
+        print(f"Post-processing {len(due)} pages on {processor.workers} processes")
+        _, wp_results = processor.run(due)
+    else:
+        if docs:
+            docs_publisher.publish((job.doc_id, job.city, partial(read_location, job.location), job.tab_title)
+                                   for job in due if job.doc_id)
+        if wp_publisher:
+            wp_results = wp_publisher.publish(wp_pages(jobs, args, journal, store, settings))
+
+    if wp_publisher:
+        failed = [result for result in wp_results if not result.ok]
+        if failed:
+            print(f"❌ {len(failed)} page(s) failed to post: {[result.key for result in failed]}")
+        wp_publisher.close()
+
+    journal.close()
+    store.close()
+    if settings.run_metrics_json or settings.run_metrics_csv:
+        metrics_json = shard_path(settings.run_metrics_json, shard_index, shard_count)
+        metrics_csv = shard_path(settings.run_metrics_csv, shard_index, shard_count)
+        metrics.print_summary(metrics.write_report(metrics_json, metrics_csv))
+        print(f"Run metrics written to {metrics_json or metrics_csv}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import json
+import time
+
+from cache import request_key
+from engine import MIN_CONTENT_CHARS, build_request, check_duplicate, duplicate_info, record_budget
+from metrics import FILE_WRITE, VALIDATION, default_metrics
+from retry import default_policy
+from templates import PromptTooLongError, compile_prompt
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# finished states of a batch job, see https://platform.openai.com/docs/guides/batch
+DONE_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def write_batch_file(path, cities, country_name, prompt_template, sys_msg, model, max_tokens, store, temperature=0.5,
+                     cache=None, journal=None, countries=None, max_prompt_tokens=None, metrics=default_metrics,
+                     dedup=None):
+    """Stream one chat-completion request per city into a JSONL batch file.
+
+    `cities` can be any iterable (a generator over a big manifest works);
+    lines are written as they are built so nothing is held in memory.
+    Cities found in `cache` are written straight to `store` (checked
+    against `dedup` like batch results) and left out of the batch, as are
+    cities the `journal` has already written.
+    `countries` maps cities to their own country, overriding `country_name`.
+    Requests too long for the model (see templates.CompiledPrompt.budget)
+    are left out and recorded as failed.
+    """
+    countries = countries or {}
+    prompt = compile_prompt(prompt_template, sys_msg)
+    count = hits = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for city_name in cities:
+            if journal and journal.done(city_name, "written"):
+                continue
+            final_prompt = prompt.render(city_name=city_name, country_name=countries.get(city_name) or country_name)
+            request = build_request(model, sys_msg, final_prompt, max_tokens, temperature)
+            cached = cache.get(request_key(request)) if cache else None
+            if cached:
+                match = None
+                if dedup:
+                    with metrics.timer(VALIDATION, city_name):
+                        match = check_duplicate(dedup, cached[0], city_name, metrics=metrics)
+                if journal:
+                    journal.record(city_name, "generated", cached=True, **duplicate_info(match))
+                with metrics.timer(FILE_WRITE, city_name):
+                    location = store.put(city_name, cached[0])
+                if journal:
+                    journal.record(city_name, "written", path=location)
+                hits += 1
+                continue
+            try:
+                budget = prompt.budget(final_prompt, model, max_tokens, max_prompt_tokens)
+            except PromptTooLongError as e:
+                print(f"❌ Leaving {city_name} out of the batch: {e}")
+                if journal:
+                    journal.fail(city_name, "generated", e)
+                continue
+            record_budget(metrics, city_name, budget)
+
+            line = {
+                "custom_id": city_name,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": request
+            }
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+            count += 1
+    print(f"Wrote {count} batch requests to {path} ({hits} served from cache)")
+    return count
+
+
+def submit_batch(client, path):
+    def upload():
+        with open(path, "rb") as f:
+            return client.files.create(file=f, purpose="batch")
+
+    def create(input_file_id):
+        return client.batches.create(
+            input_file_id=input_file_id,
+            endpoint=BATCH_ENDPOINT,
+            completion_window="24h"
+        )
+
+    batch_file = default_policy.call(upload, endpoint="openai")
+    batch = default_policy.call(create, batch_file.id, endpoint="openai")
+    print(f"Submitted batch {batch.id} (input file {batch_file.id})")
+    return batch
+
+
+def poll_batch(client, batch_id, interval=60, timeout=None):
+    start = time.time()
+    while True:
+        batch = default_policy.call(client.batches.retrieve, batch_id, endpoint="openai")
+        counts = batch.request_counts
+        if counts:
+            print(f"Batch {batch_id}: {batch.status} ({counts.completed}/{counts.total} done, {counts.failed} failed)")
+        else:
+            print(f"Batch {batch_id}: {batch.status}")
+        if batch.status in DONE_STATUSES:
+            return batch
+        if timeout is not None and time.time() - start > timeout:
+            raise TimeoutError(f"Batch {batch_id} still {batch.status} after {timeout}s")
+        time.sleep(interval)
+
+
+def iter_result_lines(client, file_id, download_path):
+    # download to disk first, then read back line by line
+    client.files.content(file_id).write_to_file(download_path)
+    with open(download_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def fan_out_results(client, batch, store, download_path="batch_output.jsonl", cache=None, requests_path=None,
+                    journal=None, metrics=default_metrics, validator=None, dedup=None):
+    """Write each successful result to `store` (see store.py).
+
+    Returns {city: location} for written pages and {city: error} for the rest.
+    With a `validator` (see validate.PageValidator) pages failing any check
+    count as failed; batches are not repaired, a rerun regenerates them.
+    With `dedup` (see dedup.DedupIndex) near duplicates are kept but
+    flagged in the journal.
+    When `cache` is given, the request bodies are read back from
+    `requests_path` so each result can be stored under its cache key.
+    """
+    keys = {}
+    if cache and requests_path:
+        with open(requests_path, encoding="utf-8") as f:
+            for line in f:
+                item = json.loads(line)
+                keys[item["custom_id"]] = request_key(item["body"])
+
+    written, failed = {}, {}
+
+    if batch.output_file_id:
+        for item in iter_result_lines(client, batch.output_file_id, download_path):
+            city_name = item["custom_id"]
+            response = item.get("response") or {}
+            if item.get("error") or response.get("status_code") != 200:
+                failed[city_name] = item.get("error") or response.get("body")
+                continue
+
+            choices = response["body"].get("choices") or []
+            content = choices[0]["message"]["content"] if choices else None
+            if validator and content:
+                with metrics.timer(VALIDATION, city_name):
+                    verdict = validator.check(content, city_name)
+                if not verdict.ok:
+                    for check in verdict.failures:
+                        metrics.count(f"invalid.{check.name}", city=city_name)
+                    failed[city_name] = f"Page failed validation: {verdict}"
+                    continue
+            # Basic validation: ensure we have at least 5000 characters
+            elif not content or len(content) < MIN_CONTENT_CHARS:
+                failed[city_name] = "Generated content too short."
+                continue
+
+            metrics.record_usage(city_name, response["body"].get("model"), response["body"].get("usage"), batch=True)
+            if city_name in keys:
+                cache.put(keys[city_name], response["body"].get("model"), content, response["body"].get("usage"))
+            match = None
+            if dedup:
+                with metrics.timer(VALIDATION, city_name):
+                    match = check_duplicate(dedup, content, city_name, metrics=metrics)
+            if journal:
+                journal.record(city_name, "generated", batch=batch.id, **duplicate_info(match))
+            with metrics.timer(FILE_WRITE, city_name):
+                location = store.put(city_name, content)
+            if journal:
+                journal.record(city_name, "written", path=location)
+            written[city_name] = location
+
+    if batch.error_file_id:
+        for item in iter_result_lines(client, batch.error_file_id, download_path + ".errors"):
+            failed[item["custom_id"]] = item.get("error") or (item.get("response") or {}).get("body")
+
+    if journal:
+        for city_name, error in failed.items():
+            journal.fail(city_name, "generated", error)
+
+    print(f"++++ {len(written)} pages written, {len(failed)} failed ++++")
+    if failed:
+        print(f"❌ Failed cities: {list(failed)}")
+    return written, failed
+
+
+def run_batch(client, cities, country_name, prompt_template, sys_msg, model, max_tokens, store, temperature=0.5,
+              input_path="batch_requests.jsonl", poll_interval=60, cache=None, journal=None, countries=None,
+              max_prompt_tokens=None, validator=None, dedup=None, download_path="batch_output.jsonl"):
+    if not write_batch_file(input_path, cities, country_name, prompt_template, sys_msg, model, max_tokens, store,
+                            temperature, cache=cache, journal=journal, countries=countries,
+                            max_prompt_tokens=max_prompt_tokens, dedup=dedup):
+        return {}, {}
+    batch = submit_batch(client, input_path)
+    batch = poll_batch(client, batch.id, interval=poll_interval)
+    if batch.status != "completed":
+        print(f"❌ Batch {batch.id} ended as {batch.status}: {batch.errors}")
+    return fan_out_results(client, batch, store, download_path=download_path, cache=cache,
+                           requests_path=input_path, journal=journal, validator=validator, dedup=dedup)
+
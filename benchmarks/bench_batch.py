@@ -0,0 +1,87 @@
+"""Benchmark: batch mode end to end against the fake Batch API.
+
+Runs run_batch three times over the same journal, cache and output
+directory: a first pass where a share of the requests fails, a resume
+that must resubmit only those, and a pass with a fresh journal that must
+be served entirely from the cache. Prints requests sent and pages written
+per pass and fails if a pass resubmits more than it should.
+
+Run from the repo root:  python -m benchmarks.bench_batch --cities 500
+"""
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+from batch import run_batch
+from benchmarks.bench_pipeline import PROMPT_TEMPLATE, SYS_MSG
+from benchmarks.fakes import FakeBatchClient
+from cache import ResponseCache
+from journal import Journal
+from store import FileStore
+from validate import PageValidator
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cities", type=int, default=200)
+    parser.add_argument("--error-rate", type=float, default=0.2, help="share of requests failing in the first pass")
+    parser.add_argument("--min-chars", type=int, default=5000)
+    parser.add_argument("--max-chars", type=int, default=15000)
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    cities = [f"City {i:04d}" for i in range(args.cities)]
+    # the sample pages name their city in every sentence, far above a real page's density
+    validator = PageValidator(city_density=(0.2, None))
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    passes = []
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        os.makedirs(os.path.join(work_dir, "pages"))
+        store = FileStore(os.path.join(work_dir, "pages"))
+        cache = ResponseCache(os.path.join(work_dir, "llm_cache.sqlite"))
+
+        def batch_pass(name, client, journal_path):
+            journal = Journal(os.path.join(work_dir, journal_path))
+            start = time.perf_counter()
+            with quiet:
+                written, failed = run_batch(client, cities, "India", PROMPT_TEMPLATE, SYS_MSG, "gpt-4.1-nano", 4000,
+                                            store, input_path=os.path.join(work_dir, "batch_requests.jsonl"),
+                                            download_path=os.path.join(work_dir, "batch_output.jsonl"),
+                                            poll_interval=0, cache=cache, journal=journal, validator=validator)
+            seconds = time.perf_counter() - start
+            pending = sum(not journal.done(city, "written") for city in cities)
+            journal.close()
+            passes.append((name, client.requests, len(written), len(failed), pending, seconds))
+            return failed
+
+        failed = batch_pass("first", FakeBatchClient(args.error_rate, args.min_chars, args.max_chars),
+                            "job_journal.jsonl")
+        batch_pass("resume", FakeBatchClient(0.0, args.min_chars, args.max_chars), "job_journal.jsonl")
+        batch_pass("cached", FakeBatchClient(0.0, args.min_chars, args.max_chars), "fresh_journal.jsonl")
+        cache.close()
+
+    print(f"\n=== {args.cities} cities, {args.error_rate:.0%} of the first pass failing ===")
+    print(f"{'pass':<8}{'sent':>7}{'written':>9}{'failed':>8}{'pending':>9}{'seconds':>9}")
+    for name, sent, written, failures, pending, seconds in passes:
+        print(f"{name:<8}{sent:>7}{written:>9}{failures:>8}{pending:>9}{seconds:>9.2f}")
+
+    (_, _, first_written, _, _, _), (_, resent, _, _, resumed_pending, _), (_, cached_sent, _, _, _, _) = passes
+    if resent != len(failed) or resumed_pending:
+        raise SystemExit(f"resume sent {resent} requests for {len(failed)} failed cities, {resumed_pending} left")
+    if cached_sent:
+        raise SystemExit(f"{cached_sent} requests sent although every page was cached")
+    return passes
+
+
+def main(argv=None):
+    run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""Benchmark: single-pass build_requests_from_html vs. the BeautifulSoup version.
+
+Run from the repo root:  python -m benchmarks.bench_html_to_docs
+Needs beautifulsoup4 for the old implementation, which is kept below
+verbatim for comparison.
+"""
+import time
+
+from bs4 import BeautifulSoup
+
+from benchmarks.pages import sample_page
+from write_doc import build_requests_from_html, clean_text, coalesce_requests
+
+TAB_ID = 't.8sh23tb4aixw'
+
+
+def legacy_build_requests_from_html(html, starting_index=1, tab_id=TAB_ID):
+    soup = BeautifulSoup(html, "html.parser")
+    body = soup.find("body")
+    if body is None:
+        body = soup  # fallback
+
+    requests = []
+    pending_styles = []
+    # Simulating the document's character index while building the requests.
+    current_index = starting_index
+
+    # helper to insert text at current_index and increment
+    def insert_text_and_advance(text):
+        nonlocal current_index, requests
+        if not text:
+            return (None, None)
+        # ensure text uses normalized newlines
+        text = text.replace('\r\n', '\n')
+        req = {"insertText": {"location": {"tabId": tab_id, "index": current_index}, "text": text}}
+        requests.append(req)
+        start = current_index
+        current_index += len(text)
+        end = current_index
+        return start, end
+
+    # collecting style requests as we go (they depend on start/end indices we've just recorded)
+    def add_text_style(start, end, style_dict):
+        # fields is comma-separated keys of style_dict
+        if start is None or end is None or start == end:
+            return
+        
+        fields = ",".join(style_dict.keys())
+        pending_styles.append({
+            "updateTextStyle": {
+                "range": {"startIndex": start, "endIndex": end, "tabId": tab_id},
+                "textStyle": style_dict,
+                "fields": fields
+            }
+        })
+
+    def add_paragraph_style(start, end, named_style):
+        if start is None or end is None or start == end:
+            return
+        requests.append({
+            "updateParagraphStyle": {
+                "range": {"startIndex": start, "endIndex": end, "tabId": tab_id},
+                "paragraphStyle": {"namedStyleType": named_style},
+                "fields": "namedStyleType"
+            }
+        })
+
+    def maybe_add_space():
+        # Insert a space only if the previous character is not a space or newline
+        nonlocal current_index, requests
+        if current_index > 1:
+            requests.append({
+                "insertText": {
+                    "location": {"tabId": tab_id, "index": current_index},
+                    "text": " "
+                }
+            })
+            current_index += 1
+
+    # Walk direct children of body to keep structure order
+    for node in body.children:
+        if isinstance(node, str):
+            text = clean_text(node)
+            if text:
+                insert_text_and_advance(text + "\n")
+            continue
+
+        name = getattr(node, "name", "").lower()
+
+        if name in ("h1", "h2", "h3", "h4"):
+            text = clean_text(node.get_text())
+            if not text:
+                continue
+            # Insert text + newline
+            start, end = insert_text_and_advance(text + "\n")
+
+            # apply bold ONLY to visible characters
+            add_text_style(start, start + len(text), {"bold": True})
+
+            # Map to named styles
+            if name == "h1":
+                add_paragraph_style(start, end, "HEADING_1")
+            elif name == "h2":
+                add_paragraph_style(start, end, "HEADING_2")
+            elif name == "h3":
+                add_paragraph_style(start, end, "HEADING_3")
+            elif name == "h4":
+                add_paragraph_style(start, end, "HEADING_4")
+        
+            
+        elif name == "p":
+            paragraph_start = current_index
+
+            prev_was_text = False  # track continuity
+
+            for child in node.children:
+                cname = getattr(child, "name", None)
+
+                if cname == "strong":
+                    t = clean_text(child.get_text())
+                    if t:
+                        # Insert space when toggling from plain → strong
+                        if prev_was_text:
+                            maybe_add_space()
+
+                        s, e = insert_text_and_advance(t)
+                        add_text_style(s, e, {"bold": True})
+                        prev_was_text = True
+
+                elif cname == "a":
+                    t = clean_text(child.get_text())
+                    href = child.get("href")
+                    if t:
+                        if prev_was_text:
+                            maybe_add_space()
+
+                        s, e = insert_text_and_advance(t)
+                        if href:
+                            add_text_style(s, e, {"link": {"url": href}})
+                        prev_was_text = True
+
+                else:
+                    plain = child if isinstance(child, str) else child.get_text()
+                    plain = clean_text(plain)
+                    if plain:
+                        if prev_was_text:
+                            maybe_add_space()
+                        insert_text_and_advance(plain)
+                        prev_was_text = True
+
+            _ , paragraph_end = insert_text_and_advance("\n")
+
+            add_paragraph_style(paragraph_start, paragraph_end, "NORMAL_TEXT")
+
+
+        elif name == "ul":
+            first_item_index = None
+            last_item_index = None
+
+            for li in node.find_all("li", recursive=False):
+                li_start = current_index
+
+                # Process children inside <li> just like <p> logic
+                for child in li.children:
+                    prev_was_text = False  # track continuity
+
+                    cname = getattr(child, "name", None)
+
+                    if cname == "strong":
+                        t = clean_text(child.get_text())
+                        if t:
+                            if prev_was_text:
+                                maybe_add_space()
+
+                            s, e = insert_text_and_advance(t)
+                            add_text_style(s, e, {"bold": True})
+
+                            # adding a space after the bold cahrecters
+                            requests.append({"insertText": {"location": {"tabId": tab_id, "index": current_index},
+                                                            "text": " "}})
+                            current_index += 1
+
+                            prev_was_text = True
+
+                    elif cname == "a":
+                        t = clean_text(child.get_text())
+                        href = child.get("href")
+                        if t:
+                            if prev_was_text:
+                                maybe_add_space()
+
+                            s, e = insert_text_and_advance(t)
+                            if href:
+                                add_text_style(s, e, {"link": {"url": href}})
+
+                            prev_was_text = True
+
+                    else:
+                        # plain text
+                        plain = child if isinstance(child, str) else child.get_text()
+                        plain = clean_text(plain)
+                        if prev_was_text:
+                            maybe_add_space()
+                        s, e = insert_text_and_advance(plain)
+                        add_paragraph_style(s, e, "NORMAL_TEXT")
+                        prev_was_text = True
+
+                # End of LI → add newline
+                li_end = insert_text_and_advance("\n")[1]
+
+                # Track bullet range
+                if first_item_index is None:
+                    first_item_index = li_start
+                last_item_index = li_end
+
+            # Apply bullets to the whole UL
+            if first_item_index is not None:
+                requests.append({
+                    "createParagraphBullets": {
+                        "range": {"startIndex": first_item_index, "endIndex": last_item_index, "tabId": tab_id},
+                        "bulletPreset": "BULLET_DISC_CIRCLE_SQUARE"
+                    }
+                })
+
+
+        elif name == "ol":
+            first_item_index = None
+            last_item_index = None
+
+            for li in node.find_all("li", recursive=False):
+                li_start = current_index
+
+                # Process children inside <li> just like <p> logic
+                for child in li.children:
+                    prev_was_text = False  # track continuity
+
+                    cname = getattr(child, "name", None)
+
+                    if cname == "strong":
+                        t = clean_text(child.get_text())
+                        if t:
+                            if prev_was_text:
+                                maybe_add_space()
+
+                            s, e = insert_text_and_advance(t)
+                            add_text_style(s, e, {"bold": True})
+                            
+                            # adding a space after the bold cahrecters
+                            requests.append({"insertText": {"location": {"tabId": tab_id, "index": current_index},
+                                                            "text": " "}})
+                            current_index += 1
+
+                            prev_was_text = True
+
+                    elif cname == "a":
+                        t = clean_text(child.get_text())
+                        href = child.get("href")
+                        if t:
+                            if prev_was_text:
+                                maybe_add_space()
+
+                            s, e = insert_text_and_advance(t)
+                            if href:
+                                add_text_style(s, e, {"link": {"url": href}})
+
+                            prev_was_text = True
+
+                    else:
+                        # plain text
+                        plain = child if isinstance(child, str) else child.get_text()
+                        plain = clean_text(plain)
+                        if prev_was_text:
+                            maybe_add_space()
+                        s, e = insert_text_and_advance(plain)
+                        add_paragraph_style(s, e, "NORMAL_TEXT")
+                        prev_was_text = True
+
+                # End of LI → add newline
+                li_end = insert_text_and_advance("\n")[1]
+
+                # Track bullet range
+                if first_item_index is None:
+                    first_item_index = li_start
+                last_item_index = li_end
+
+            # Apply bullets to the whole UL
+            if first_item_index is not None:
+                requests.append({
+                    "createParagraphBullets": {
+                        "range": {"startIndex": first_item_index, "endIndex": last_item_index, "tabId": tab_id},
+                        "bulletPreset": "NUMBERED_DECIMAL_ALPHA_ROMAN"
+                    }
+                })
+
+            requests.extend(pending_styles)
+            pending_styles = []
+
+    if pending_styles:     # remaining styles also apended to the request list
+        requests.extend(pending_styles)
+        pending_styles = []
+
+    return requests
+
+
+def best_of(fn, html, repeat=5):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(html)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    print(f"{'sections':>8} {'chars':>9} {'requests':>9} {'coalesced':>10} {'bs4 ms':>9} {'single-pass ms':>15} {'speedup':>8}")
+    for sections in (3, 6, 30, 150, 600):
+        html = f"<html><body>{sample_page('Chennai', sections)}</body></html>"
+        new = build_requests_from_html(html)
+        old = legacy_build_requests_from_html(html)
+        if new != old:
+            raise SystemExit(f"Output differs from the BeautifulSoup version at {sections} sections")
+
+        old_t = best_of(legacy_build_requests_from_html, html)
+        new_t = best_of(build_requests_from_html, html)
+        coalesced = len(coalesce_requests(new))
+        print(f"{sections:>8} {len(html):>9} {len(new):>9} {coalesced:>10} {old_t * 1000:>9.1f} {new_t * 1000:>15.1f} {old_t / new_t:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
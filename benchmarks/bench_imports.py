@@ -0,0 +1,59 @@
+"""Benchmark: how long each pipeline module takes to import.
+
+Imports every module in a fresh interpreter (so nothing is cached from
+the previous one), keeps the best of --repeat runs and lists the heavy
+third-party packages the import dragged in. Only the stage that uses
+openai, the Google client or requests should pay for them.
+
+Run from the repo root:  python -m benchmarks.bench_imports
+"""
+import argparse
+import json
+import subprocess
+import sys
+
+MODULES = ("app", "engine", "providers", "batch", "docs_publisher", "write_doc", "post", "postprocess", "dedup",
+           "store", "retry")
+# loaded only where a stage needs them
+HEAVY = ("asyncio", "openai", "requests", "googleapiclient", "google.oauth2", "httplib2", "bs4", "ssl")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps([seconds, [name for name in {heavy!r} if name in sys.modules]]))
+"""
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module; the best run counts")
+    return parser.parse_args(argv)
+
+
+def import_time(module, repeat):
+    best, heavy = None, []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", PROBE.format(module=module, heavy=HEAVY)],
+                             capture_output=True, text=True, check=True).stdout
+        seconds, heavy = json.loads(out.splitlines()[-1])
+        best = seconds if best is None else min(best, seconds)
+    return best, heavy
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    print(f"{'module':<16}{'ms':>8}  heavy imports")
+    for module in args.modules:
+        try:
+            seconds, heavy = import_time(module, args.repeat)
+        except subprocess.CalledProcessError as e:
+            print(f"{module:<16}{'-':>8}  failed: {e.stderr.strip().splitlines()[-1]}")
+            continue
+        print(f"{module:<16}{seconds * 1000:>8.1f}  {', '.join(heavy) or '-'}")
+
+
+if __name__ == "__main__":
+    main()
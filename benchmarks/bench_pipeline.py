@@ -0,0 +1,144 @@
+"""Benchmark: the full city pipeline against local fakes.
+
+Generates every city with Engine, writes the pages into Docs tabs with
+DocsPublisher and posts them with WordPressPublisher, all against the
+fakes in benchmarks/fakes.py, then prints throughput per stage and the
+p50/p99 of every instrumented stage.
+
+Run from the repo root:  python -m benchmarks.bench_pipeline --cities 200
+Needs `requests` (the WordPress stage goes through a real local HTTP server).
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+from functools import partial
+
+from benchmarks.fakes import FakeDocsService, FakeLLM, FakeWordPress
+from docs_publisher import DocsPublisher
+from engine import Engine
+from metrics import Metrics
+from post import WordPressPublisher
+from retry import RetryPolicy
+from store import FileStore, output_path_for, read_page
+from validate import PageValidator
+
+SYS_MSG = "You are an SEO copywriter. Answer with the HTML of the page only, without a <html> wrapper."
+# roughly the size of the production prompt
+PROMPT_TEMPLATE = (
+    "Write an SEO landing page for a digital marketing agency in {city_name}, {country_name}. "
+    "Use one <h1>, six <h2> sections about our services, short paragraphs, bullet lists and an FAQ. "
+    + "Mention local landmarks and industries, keep the tone professional and avoid keyword stuffing. " * 12
+)
+DOC_ID = "benchmark-doc"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--cities", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16, help="LLM requests in flight to start with")
+    parser.add_argument("--max-concurrency", type=int, help="cap of the adaptive concurrency (default 4x)")
+    parser.add_argument("--rpm", type=int, default=1_000_000, help="requests per minute the Engine starts pacing at")
+    parser.add_argument("--tpm", type=int, default=1_000_000_000, help="tokens per minute the Engine starts pacing at")
+    parser.add_argument("--llm-quota-rpm", type=int, help="requests per minute the fake LLM allows (x-ratelimit-*)")
+    parser.add_argument("--llm-quota-tpm", type=int, help="tokens per minute the fake LLM allows")
+    parser.add_argument("--stream", action="store_true", help="stream pages to disk")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="seconds per completion")
+    parser.add_argument("--llm-ttft", type=float, default=0.3)
+    parser.add_argument("--llm-429", type=float, default=0.05, help="share of completions answered with 429")
+    parser.add_argument("--docs-workers", type=int, default=4)
+    parser.add_argument("--docs-latency", type=float, default=0.2)
+    parser.add_argument("--docs-429", type=float, default=0.02)
+    parser.add_argument("--wp-workers", type=int, default=8)
+    parser.add_argument("--wp-latency", type=float, default=0.3)
+    parser.add_argument("--wp-429", type=float, default=0.02)
+    parser.add_argument("--wp-upsert", action="store_true", help="post with slug/hash upserts")
+    parser.add_argument("--min-chars", type=int, default=5000)
+    parser.add_argument("--max-chars", type=int, default=15000)
+    parser.add_argument("--report", help="also write the metrics report as JSON to this path")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own per-page output")
+    return parser.parse_args(argv)
+
+
+def run(args):
+    cities = [f"City {i:04d}" for i in range(args.cities)]
+    metrics = Metrics()
+    # short backoff: the fakes ask for sub-second Retry-After waits
+    policy = RetryPolicy(max_attempts=6, base=0.05, cap=2.0, metrics=metrics)
+    llm = FakeLLM(latency=args.llm_latency, ttft=args.llm_ttft, rate_limit_rate=args.llm_429,
+                  min_chars=args.min_chars, max_chars=args.max_chars, quota_rpm=args.llm_quota_rpm,
+                  quota_tpm=args.llm_quota_tpm)
+    docs = FakeDocsService(cities, latency=args.docs_latency, rate_limit_rate=args.docs_429)
+    stages = {}
+    quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+
+    with tempfile.TemporaryDirectory() as output_dir, quiet, \
+            FakeWordPress(latency=args.wp_latency, rate_limit_rate=args.wp_429) as wp:
+        engine = Engine(llm, PROMPT_TEMPLATE, SYS_MSG, "gpt-4.1-nano", 4000, FileStore(output_dir),
+                        concurrency=args.concurrency, max_concurrency=args.max_concurrency, rpm=args.rpm,
+                        tpm=args.tpm, retry_policy=policy,
+                        stream=args.stream, metrics=metrics,
+                        # the sample pages name their city in every sentence, far above a real page's density
+                        validator=PageValidator(city_density=(0.2, None)))
+        start = time.perf_counter()
+        results = asyncio.run(engine.run(cities, "India"))
+        written = [city for city, result in results.items() if isinstance(result, str)]
+        stages["generate"] = (len(written), time.perf_counter() - start)
+
+        docs_publisher = DocsPublisher(service_factory=lambda: docs, workers=args.docs_workers,
+                                       retry_policy=policy, metrics=metrics)
+        start = time.perf_counter()
+        # one document per 50 cities, like a site split over several docs
+        docs_results = docs_publisher.publish(
+            (f"{DOC_ID}-{i // 50}", city, partial(read_page, output_path_for(city, output_dir)))
+            for i, city in enumerate(written)
+        )
+        updated = sum(not isinstance(result, Exception) for result in docs_results.values())
+        stages["docs"] = (updated, time.perf_counter() - start)
+
+        wp_publisher = WordPressPublisher(wp.url, "bench", "secret", featured_img_url="https://example.com/f.jpg",
+                                          social_image="https://example.com/s.jpg", brand_name="Bench",
+                                          workers=args.wp_workers, retry_policy=policy, metrics=metrics,
+                                          upsert=args.wp_upsert)
+        start = time.perf_counter()
+        pages = ({"key": city, "html_content": read_page(output_path_for(city, output_dir)),
+                  "page_title": f"Digital Marketing Agency in {city}", "key_phrase": f"digital marketing {city}",
+                  "description": f"Grow your business in {city}."} for city in written)
+        posted = sum(result.ok for result in wp_publisher.publish(pages))
+        stages["wordpress"] = (posted, time.perf_counter() - start)
+        wp_publisher.close()
+
+    print(f"\n=== {args.cities} cities, concurrency {args.concurrency}, "
+          f"{'streaming' if args.stream else 'non-streaming'} ===")
+    print(f"{'stage':<12}{'pages':>7}{'seconds':>10}{'pages/s':>10}")
+    for stage, (count, seconds) in stages.items():
+        print(f"{stage:<12}{count:>7}{seconds:>10.2f}{count / seconds if seconds else 0:>10.1f}")
+    total = sum(seconds for _, seconds in stages.values())
+    print(f"{'end to end':<12}{posted:>7}{total:>10.2f}{posted / total if total else 0:>10.1f}")
+    print(f"llm pacing: concurrency {args.concurrency} -> {engine.semaphore.limit:.1f}, "
+          f"{args.rpm} -> {engine.limiter.requests.capacity:.0f} rpm, {args.tpm} -> {engine.limiter.tokens.capacity:.0f} tpm")
+    print(f"fakes: llm {llm.calls} calls ({llm.rate_limited} x 429), docs {docs.batch_updates} batchUpdates "
+          f"with {docs.requests} requests ({docs.rate_limited} x 429), wp {wp.posts} posts ({wp.rate_limited} x 429)")
+
+    report = metrics.summary()
+    metrics.print_summary(report)
+    if args.report:
+        report["throughput"] = {stage: {"pages": count, "seconds": seconds} for stage, (count, seconds) in stages.items()}
+        report["args"] = vars(args)
+        os.makedirs(os.path.dirname(args.report) or ".", exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
+    return report
+
+
+def main(argv=None):
+    run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    main()
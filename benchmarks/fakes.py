@@ -0,0 +1,410 @@
+"""Local stand-ins for OpenAI (chat and Batch API), Google Docs and WordPress.
+
+Each fake has a configurable latency, a share of requests answered with
+429 (plus a Retry-After hint) and page sizes in the 5-15k character
+range; the LLM can also enforce a per-minute quota and report it in
+OpenAI's x-ratelimit-* headers, so the real pipeline code can be timed without any network or
+API keys.
+"""
+import asyncio
+import io
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+from benchmarks.pages import sample_page
+from rate_limit import estimate_tokens
+
+
+def jittered(rng, latency, jitter=0.25):
+    return max(0.0, latency * rng.uniform(1 - jitter, 1 + jitter))
+
+
+class FakeRateLimitError(Exception):
+    """Looks like openai.RateLimitError to retry.classify / retry_after."""
+
+    def __init__(self, retry_after_ms, headers=None):
+        super().__init__("429 Too Many Requests (fake)")
+        self.status_code = 429
+        self.response = SimpleNamespace(status_code=429,
+                                        headers=dict(headers or {}, **{"retry-after-ms": str(retry_after_ms)}))
+
+
+class _FakeRawResponse:
+    # what openai's with_raw_response.create returns: headers plus parse()
+    def __init__(self, result, headers):
+        self.result = result
+        self.headers = headers
+
+    def parse(self):
+        return self.result
+
+
+class FakeHttpResponse(dict):
+    # httplib2 responses are dicts of headers with a .status
+    def __init__(self, status, headers=None):
+        super().__init__(headers or {})
+        self.status = status
+
+
+class FakeHttpError(Exception):
+    """Looks like googleapiclient's HttpError to the retry policy."""
+
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status} (fake)")
+        self.resp = FakeHttpResponse(status, {"retry-after": str(retry_after)} if retry_after else None)
+
+
+def page_for(city_name, min_chars=5000, max_chars=15000):
+    """A sample page for `city_name` between min_chars and max_chars long."""
+    rng = random.Random(city_name)
+    target = rng.randint(min_chars, max_chars)
+    sections = 1
+    html = sample_page(city_name, sections)
+    while len(html) < target:
+        sections += 1
+        html = sample_page(city_name, sections)
+    return html
+
+
+class _FakeStream:
+    def __init__(self, text, ttft, duration, usage, chunk_chars=400):
+        self.parts = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+        self.ttft = ttft
+        self.gap = max(0.0, duration - ttft) / max(len(self.parts), 1)
+        self.usage = usage
+
+    def __aiter__(self):
+        return self._chunks()
+
+    async def _chunks(self):
+        await asyncio.sleep(self.ttft)
+        for i, part in enumerate(self.parts):
+            if i:
+                await asyncio.sleep(self.gap)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=part))], usage=None)
+        yield SimpleNamespace(choices=[], usage=self.usage)
+
+    async def close(self):
+        pass
+
+
+class FakeLLM:
+    """Async client with the `chat.completions.create` surface Engine uses.
+
+    The page is written for the city matched by `city_pattern` in the
+    user prompt ("... in <city>, <country>" by default), so each city
+    always gets the same page. With `quota_rpm` / `quota_tpm` requests
+    over the last minute's quota (tokens counted as prompt + max_tokens,
+    like OpenAI) get a 429, and `with_raw_response.create` reports the
+    quota in x-ratelimit-* headers.
+    """
+
+    def __init__(self, latency=1.0, ttft=0.3, rate_limit_rate=0.0, retry_after_ms=200,
+                 min_chars=5000, max_chars=15000, seed=0, city_pattern=r" in ([^,.]+),",
+                 quota_rpm=None, quota_tpm=None):
+        self.city_pattern = re.compile(city_pattern)
+        self.latency = latency
+        self.ttft = ttft
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after_ms = retry_after_ms
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.rng = random.Random(seed)
+        self.quota_rpm = quota_rpm
+        self.quota_tpm = quota_tpm
+        self.window = deque()  # (time, tokens) of the last minute's requests
+        self.calls = 0
+        self.rate_limited = 0
+        self.chat = SimpleNamespace(completions=self)
+        self.with_raw_response = SimpleNamespace(create=self._create_raw)
+
+    def _quota_headers(self, tokens):
+        """Charge a request against the quota; returns (allowed, x-ratelimit-* headers)."""
+        now = time.monotonic()
+        while self.window and now - self.window[0][0] >= 60:
+            self.window.popleft()
+        used_requests = len(self.window)
+        used_tokens = sum(charged for _, charged in self.window)
+        allowed = ((self.quota_rpm is None or used_requests < self.quota_rpm)
+                   and (self.quota_tpm is None or used_tokens + tokens <= self.quota_tpm))
+        if allowed:
+            self.window.append((now, tokens))
+            used_requests += 1
+            used_tokens += tokens
+        reset = f"{max(0.0, 60 - (now - self.window[0][0])) if self.window else 0:.3f}s"
+        headers = {}
+        if self.quota_rpm is not None:
+            headers.update({"x-ratelimit-limit-requests": str(self.quota_rpm),
+                            "x-ratelimit-remaining-requests": str(max(0, self.quota_rpm - used_requests)),
+                            "x-ratelimit-reset-requests": reset})
+        if self.quota_tpm is not None:
+            headers.update({"x-ratelimit-limit-tokens": str(self.quota_tpm),
+                            "x-ratelimit-remaining-tokens": str(max(0, self.quota_tpm - used_tokens)),
+                            "x-ratelimit-reset-tokens": reset})
+        return allowed, headers
+
+    async def _create_raw(self, model, messages, stream=False, **kwargs):
+        headers = {}
+        result = await self.create(model, messages, stream=stream, _headers=headers, **kwargs)
+        return _FakeRawResponse(result, headers)
+
+    def _usage(self, messages, content):
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        return SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=estimate_tokens(content),
+                               total_tokens=prompt_tokens + estimate_tokens(content),
+                               prompt_tokens_details=SimpleNamespace(cached_tokens=0))
+
+    async def create(self, model, messages, stream=False, _headers=None, **kwargs):
+        self.calls += 1
+        allowed, headers = self._quota_headers(sum(estimate_tokens(m["content"]) for m in messages)
+                                               + kwargs.get("max_tokens", 0))
+        if _headers is not None:
+            _headers.update(headers)
+        if not allowed:
+            self.rate_limited += 1
+            await asyncio.sleep(0.01)
+            # over quota until the oldest request of the window expires
+            reset = headers.get("x-ratelimit-reset-requests") or headers.get("x-ratelimit-reset-tokens")
+            raise FakeRateLimitError(int(float(reset[:-1]) * 1000), headers)
+        if self.rng.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            await asyncio.sleep(0.01)
+            raise FakeRateLimitError(self.retry_after_ms, headers)
+
+        match = self.city_pattern.search(messages[-1]["content"])
+        city_name = match.group(1) if match else "Springfield"
+        content = page_for(city_name, self.min_chars, self.max_chars)
+        usage = self._usage(messages, content)
+        duration = jittered(self.rng, self.latency)
+        if stream:
+            return _FakeStream(content, min(jittered(self.rng, self.ttft), duration), duration, usage)
+        await asyncio.sleep(duration)
+        message = SimpleNamespace(content=content)
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+class _FakeFileContent:
+    def __init__(self, data):
+        self.data = data
+
+    def write_to_file(self, path):
+        with open(path, "wb") as f:
+            f.write(self.data)
+
+
+class FakeBatchClient:
+    """The files/batches endpoints of the OpenAI Batch API.
+
+    A batch completes as soon as it is created: every request is answered
+    with the page of the city in its custom_id, except for a share
+    `error_rate` that lands in the error file instead.
+    """
+
+    def __init__(self, error_rate=0.0, min_chars=5000, max_chars=15000, seed=0):
+        self.error_rate = error_rate
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self._files = {}
+        self._batches = {}
+        self.files = SimpleNamespace(create=self._create_file, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=self._batches.__getitem__)
+
+    def _add_file(self, data):
+        file_id = f"file-{uuid.uuid4().hex}"
+        self._files[file_id] = data
+        return file_id
+
+    def _create_file(self, file, purpose):
+        return SimpleNamespace(id=self._add_file(file.read()), purpose=purpose)
+
+    def _file_content(self, file_id):
+        return _FakeFileContent(self._files[file_id])
+
+    def _answer(self, item):
+        body = item["body"]
+        content = page_for(item["custom_id"], self.min_chars, self.max_chars)
+        prompt_tokens = sum(estimate_tokens(m["content"]) for m in body["messages"])
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": estimate_tokens(content),
+                 "total_tokens": prompt_tokens + estimate_tokens(content)}
+        return {"model": body["model"], "choices": [{"message": {"role": "assistant", "content": content}}],
+                "usage": usage}
+
+    def _create_batch(self, input_file_id, endpoint, completion_window):
+        out, err = io.StringIO(), io.StringIO()
+        completed = failed = 0
+        for line in self._files[input_file_id].decode("utf-8").splitlines():
+            item = json.loads(line)
+            self.requests += 1
+            if self.rng.random() < self.error_rate:
+                err.write(json.dumps({"custom_id": item["custom_id"], "response": None,
+                                      "error": {"code": "server_error", "message": "fake batch error"}}) + "\n")
+                failed += 1
+                continue
+            out.write(json.dumps({"custom_id": item["custom_id"], "error": None,
+                                  "response": {"status_code": 200, "body": self._answer(item)}}) + "\n")
+            completed += 1
+        self.errors += failed
+
+        batch = SimpleNamespace(
+            id=f"batch-{uuid.uuid4().hex}", status="completed", errors=None,
+            output_file_id=self._add_file(out.getvalue().encode("utf-8")) if completed else None,
+            error_file_id=self._add_file(err.getvalue().encode("utf-8")) if failed else None,
+            request_counts=SimpleNamespace(total=completed + failed, completed=completed, failed=failed)
+        )
+        self._batches[batch.id] = batch
+        return batch
+
+
+class _FakeRequest:
+    def __init__(self, fn):
+        self.fn = fn
+
+    def execute(self):
+        return self.fn()
+
+
+class FakeDocsService:
+    """The documents().get / batchUpdate part of the Docs v1 client.
+
+    Every document has one tab per name in `tab_titles`. Thread-safe, so
+    one instance can back all DocsPublisher workers.
+    """
+
+    def __init__(self, tab_titles, latency=0.2, rate_limit_rate=0.0, seed=0):
+        self.tab_titles = list(tab_titles)
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.batch_updates = 0
+        self.requests = 0
+        self.rate_limited = 0
+
+    def documents(self):
+        return self
+
+    def _call(self, fn):
+        with self.lock:
+            limited = self.rng.random() < self.rate_limit_rate
+            delay = jittered(self.rng, self.latency)
+            self.rate_limited += limited
+        if limited:
+            time.sleep(0.01)
+            raise FakeHttpError(429, retry_after=0)
+        time.sleep(delay)
+        return fn()
+
+    def get(self, documentId, **kwargs):
+        def tabs():
+            return {"tabs": [{"tabProperties": {"title": title, "tabId": f"t.{i}"}}
+                             for i, title in enumerate(self.tab_titles)]}
+        return _FakeRequest(lambda: self._call(tabs))
+
+    def batchUpdate(self, documentId, body):
+        def update():
+            with self.lock:
+                self.batch_updates += 1
+                self.requests += len(body["requests"])
+            return {"documentId": documentId, "replies": [{} for _ in body["requests"]]}
+        return _FakeRequest(lambda: self._call(update))
+
+
+class FakeWordPress:
+    """Minimal WordPress pages endpoint on a local HTTP server.
+
+    Supports creating (POST /wp/v2/pages), updating (POST .../<id>) and
+    listing (GET with per_page/page and X-WP-TotalPages). Use as a context
+    manager; `url` is the pages endpoint.
+    """
+
+    def __init__(self, latency=0.3, rate_limit_rate=0.0, seed=0):
+        self.latency = latency
+        self.rate_limit_rate = rate_limit_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.posts = 0
+        self.rate_limited = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/wp-json/wp/v2/pages"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _handler(self):
+        wp = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def reply(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def throttled(self):
+                with wp.lock:
+                    limited = wp.rng.random() < wp.rate_limit_rate
+                    delay = jittered(wp.rng, wp.latency)
+                    wp.rate_limited += limited
+                if limited:
+                    self.reply(429, {"code": "rest_too_many_requests"}, {"Retry-After": "0"})
+                    return True
+                time.sleep(delay)
+                return False
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                per_page = int(query.get("per_page", ["10"])[0])
+                page = int(query.get("page", ["1"])[0])
+                with wp.lock:
+                    items = sorted(wp.pages.values(), key=lambda p: p["id"])
+                total_pages = max(1, -(-len(items) // per_page))
+                chunk = items[(page - 1) * per_page:page * per_page]
+                self.reply(200, chunk, {"X-WP-Total": str(len(items)), "X-WP-TotalPages": str(total_pages)})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                if self.throttled():
+                    return
+                match = re.search(r"/(\d+)$", urlparse(self.path).path)
+                with wp.lock:
+                    wp.posts += 1
+                    if match:
+                        post_id = int(match.group(1))
+                        if post_id not in wp.pages:
+                            return self.reply(404, {"code": "rest_post_invalid_id"})
+                    else:
+                        post_id = len(wp.pages) + 1
+                    slug = body.get("slug") or re.sub(r"[^a-z0-9]+", "-", body["title"].lower()).strip("-")
+                    wp.pages[post_id] = {"id": post_id, "slug": slug, "link": f"https://example.com/{slug}/",
+                                         "meta": body.get("meta", {})}
+                    page = wp.pages[post_id]
+                self.reply(200 if match else 201, page)
+
+        return Handler
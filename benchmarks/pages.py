@@ -0,0 +1,36 @@
+import random
+
+SERVICES = ["Web Design", "SEO", "Content Writing", "Social Media Marketing", "PPC Advertising", "Branding"]
+WORDS = ("digital growth local business customers search results traffic leads strategy brand online "
+         "visibility conversion campaign audience website ranking quality service team experience").split()
+
+
+def sentence(rng, city_name, n=14):
+    words = [rng.choice(WORDS) for _ in range(n)]
+    words[rng.randrange(n)] = city_name
+    return " ".join(words).capitalize() + "."
+
+
+def sample_page(city_name, sections=6, seed=None):
+    """A generated-looking city landing page, about 2k characters per section."""
+    rng = random.Random(seed if seed is not None else city_name)
+    parts = [f"<h1>Best Digital Marketing Agency in {city_name}</h1>"]
+    for i in range(sections):
+        service = SERVICES[i % len(SERVICES)]
+        parts.append(f"<h2>{service} Services in {city_name}</h2>")
+        for _ in range(3):
+            parts.append(
+                f"<p>{sentence(rng, city_name)} <strong>{service} in {city_name}</strong> "
+                f"{sentence(rng, city_name)} <a href=\"https://example.com/{service.lower().replace(' ', '-')}\">"
+                f"Learn more</a> {sentence(rng, city_name)}</p>"
+            )
+        tag = "ul" if i % 2 else "ol"
+        items = "".join(
+            f"<li><strong>{rng.choice(WORDS).title()}:</strong> {sentence(rng, city_name, 10)}</li>"
+            for _ in range(5)
+        )
+        parts.append(f"<{tag}>{items}</{tag}>")
+    parts.append(f"<h2>FAQ about {service} in {city_name}</h2>")
+    for _ in range(3):
+        parts.append(f"<h3>{sentence(rng, city_name, 8)[:-1]}?</h3><p>{sentence(rng, city_name)}</p>")
+    return "\n".join(parts)
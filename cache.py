@@ -0,0 +1,123 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+def request_key(request):
+    """Content hash of a full chat-completion request (model, messages, params)."""
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def usage_to_dict(usage):
+    """Plain JSON-ready copy of a usage object, nested details included."""
+    if hasattr(usage, "model_dump"):
+        return usage.model_dump()
+    if isinstance(usage, dict):
+        return {name: usage_to_dict(value) for name, value in usage.items()}
+    if isinstance(usage, (list, tuple)):
+        return [usage_to_dict(value) for value in usage]
+    if hasattr(usage, "__dict__"):
+        return {name: usage_to_dict(value) for name, value in vars(usage).items()}
+    return usage
+
+
+class ResponseCache:
+    """Persistent SQLite cache of generated pages keyed by `request_key`.
+
+    Entries older than `max_age` seconds are misses and are dropped when
+    the cache is opened; when the stored content grows past `max_bytes`
+    the least recently used entries go first. Reads only note the access
+    time, it is written with the next `put` or on `close`.
+    """
+
+    def __init__(self, path="llm_cache.sqlite", max_bytes=500 * 1024 * 1024, max_age=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._accessed = {}  # key -> access time not yet written
+        self.size = 0  # bytes of content stored, kept up to date by put/evict
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                content TEXT NOT NULL,
+                usage TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+        self.conn.commit()
+        self.evict()
+
+    def get(self, key):
+        """Return (content, usage dict) for `key`, or None on a miss."""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT content, usage, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age and now - row[2] > self.max_age):
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            self.hits += 1
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def put(self, key, model, content, usage=None):
+        now = time.time()
+        size = len(content.encode("utf-8"))
+        with self._lock:
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, model, content, json.dumps(usage_to_dict(usage)), size, now, now)
+            )
+            self._accessed.pop(key, None)
+            self.size += size - (row[0] if row else 0)
+            if self.max_bytes and self.size > self.max_bytes:
+                self._drop_least_recent()
+            self._flush_accessed()
+            self.conn.commit()
+
+    def _flush_accessed(self):
+        if self._accessed:
+            self.conn.executemany("UPDATE responses SET accessed_at = ? WHERE key = ?",
+                                  [(accessed, key) for key, accessed in self._accessed.items()])
+            self._accessed.clear()
+
+    def _drop_least_recent(self):
+        # walk from least recently used until we are back under the limit
+        self._flush_accessed()
+        drop = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY accessed_at"):
+            if self.size <= self.max_bytes:
+                break
+            drop.append((key,))
+            self.size -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", drop)
+
+    def evict(self):
+        with self._lock:
+            if self.max_age:
+                self.conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,))
+            self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if self.max_bytes and self.size > self.max_bytes:
+                self._drop_least_recent()
+            self._flush_accessed()
+            self.conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self.conn.commit()
+        self.conn.close()
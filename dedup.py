@@ -0,0 +1,189 @@
+import hashlib
+import html as html_lib
+import re
+import sqlite3
+import threading
+from array import array
+from collections import defaultdict, namedtuple
+
+from retry import ContentError
+
+TAG_PATTERN = re.compile(r"<[^>]*>")
+WORD_PATTERN = re.compile(r"\w+")
+CITY_TOKEN = "_city_"
+
+# another stored page this one is too similar to; similarity is the estimated Jaccard index
+Match = namedtuple("Match", "key similarity")
+
+
+class DuplicateContentError(ContentError):
+    """The page is a near duplicate of one already generated; another sample may not be."""
+
+
+def page_words(html, city_name=None):
+    """Lower-cased words of the page text, with the city's own name masked."""
+    text = html_lib.unescape(TAG_PATTERN.sub(" ", html)).lower()
+    if city_name:
+        # pages that only differ in the city name are exactly what we want to catch
+        text = re.sub(r"\b" + re.escape(city_name.lower()) + r"\b", CITY_TOKEN, text)
+    return WORD_PATTERN.findall(text)
+
+
+def shingle_hashes(words, size=5):
+    """64-bit hashes of every run of `size` consecutive words."""
+    if len(words) < size:
+        words = words + [""] * (size - len(words))
+    return {int.from_bytes(hashlib.blake2b(" ".join(words[i:i + size]).encode("utf-8"), digest_size=8).digest(),
+                           "little")
+            for i in range(len(words) - size + 1)}
+
+
+def minhash(hashes, num_perm):
+    """One-permutation MinHash: each hash goes to bin h % num_perm, each bin keeps its minimum.
+
+    Equal bins between two pages estimate their Jaccard similarity like
+    num_perm separate hash functions would, at one hash per shingle.
+    Empty bins (short pages) borrow from the next filled bin, offset by the
+    distance, so they stay comparable (rotation densification).
+    """
+    empty = 1 << 64
+    bins = [empty] * num_perm
+    for h in hashes:
+        i = h % num_perm
+        value = h // num_perm
+        if value < bins[i]:
+            bins[i] = value
+    if empty in bins:
+        filled = [i for i, value in enumerate(bins) if value != empty]
+        if not filled:
+            return array("Q", [0] * num_perm)
+        for i in range(num_perm):
+            if bins[i] == empty:
+                j = next((j for j in filled if j > i), filled[0])
+                distance = (j - i) % num_perm
+                bins[i] = (bins[j] + distance * 0x9E3779B97F4A7C15) & (empty - 1)
+    return array("Q", bins)
+
+
+def lsh_bands(num_perm, threshold):
+    """(bands, rows) splitting the signature so pairs at `threshold` almost always share a band.
+
+    A pair with similarity s shares a band with probability 1 - (1 - s**rows)**bands,
+    an S-curve rising around (1 / bands) ** (1 / rows); take the steepest split
+    whose rise is still below the threshold.
+    """
+    splits = [(num_perm // rows, rows) for rows in range(1, num_perm + 1) if num_perm % rows == 0]
+    below = [(bands, rows) for bands, rows in splits if (1 / bands) ** (1 / rows) <= threshold * 0.9]
+    return max(below, key=lambda split: split[1]) if below else splits[0]
+
+
+class DedupIndex:
+    """Finds generated pages that are near copies of each other, without comparing every pair.
+
+    Each page becomes a MinHash signature (see minhash) of its
+    `shingle_words`-word shingles (tags stripped, city name masked), so the share of equal
+    signature slots estimates the Jaccard similarity of two pages. The
+    signatures are cut into LSH bands and bucketed per band; a new page is
+    only compared with the pages sharing a bucket with it, which keeps a
+    check against 10k pages at a few dict lookups. Pages at or above
+    `threshold` are reported as a Match. With a `path`, signatures are kept
+    in SQLite so a later run does not re-read every stored page.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, shingle_words=5, path=None):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_words = shingle_words
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.signatures = {}
+        self.buckets = [defaultdict(set) for _ in range(self.bands)]
+        self._lock = threading.Lock()
+        self.path = path
+        self.conn = None
+        if path:
+            self._open(path, f"{num_perm}:{shingle_words}")
+
+    def _open(self, path, params):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS signatures (key TEXT PRIMARY KEY, signature BLOB NOT NULL)")
+        row = self.conn.execute("SELECT value FROM meta WHERE name = 'params'").fetchone()
+        if row and row[0] != params:
+            # signatures from other settings do not compare, start over
+            self.conn.execute("DELETE FROM signatures")
+        self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('params', ?)", (params,))
+        self.conn.commit()
+        for key, blob in self.conn.execute("SELECT key, signature FROM signatures"):
+            signature = array("Q")
+            signature.frombytes(blob)
+            self._index(key, signature)
+
+    def signature(self, html, city_name=None):
+        return minhash(shingle_hashes(page_words(html, city_name), self.shingle_words), self.num_perm)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows].tobytes() for i in range(self.bands)]
+
+    def _index(self, key, signature):
+        old = self.signatures.get(key)
+        if old is not None:
+            for bucket, band in zip(self.buckets, self._band_keys(old)):
+                bucket[band].discard(key)
+        self.signatures[key] = signature
+        for bucket, band in zip(self.buckets, self._band_keys(signature)):
+            bucket[band].add(key)
+
+    def similar(self, signature, exclude=None):
+        """Matches at or above the threshold, most similar first."""
+        with self._lock:
+            candidates = set()
+            for bucket, band in zip(self.buckets, self._band_keys(signature)):
+                candidates.update(bucket.get(band, ()))
+            candidates.discard(exclude)
+            matches = []
+            for key in candidates:
+                other = self.signatures[key]
+                similarity = sum(map(int.__eq__, signature, other)) / self.num_perm
+                if similarity >= self.threshold:
+                    matches.append(Match(key, similarity))
+        return sorted(matches, key=lambda match: match.similarity, reverse=True)
+
+    def add(self, key, signature):
+        with self._lock:
+            self._index(key, signature)
+            if self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO signatures VALUES (?, ?)", (key, signature.tobytes()))
+                self.conn.commit()
+
+    def check(self, key, html, city_name=None, add=True):
+        """Best Match for a page (None if it is unique enough), indexing it under `key` unless `add` is False."""
+        signature = self.signature(html, city_name)
+        matches = self.similar(signature, exclude=key)
+        if add:
+            self.add(key, signature)
+        return matches[0] if matches else None
+
+    def update(self, store, cities):
+        """Index the stored pages of `cities` not indexed yet; returns {city: Match} of those that are duplicates."""
+        found = {}
+        for city_name in cities:
+            if city_name in self.signatures:
+                continue
+            try:
+                content = store.get(city_name)
+            except (OSError, KeyError):
+                continue  # not written yet
+            match = self.check(city_name, content, city_name)
+            if match:
+                found[city_name] = match
+        return found
+
+    def __contains__(self, key):
+        return key in self.signatures
+
+    def close(self):
+        if self.conn:
+            self.conn.close()
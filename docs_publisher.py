@@ -0,0 +1,147 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DOCS_BATCH_UPDATE, HTML_TO_DOCS, default_metrics
+from retry import default_policy
+from write_doc import build_docs_service, build_requests_from_html, coalesce_requests
+
+# only the tab ids and titles, not the whole document body
+TAB_FIELDS = "tabs(tabProperties(tabId,title),childTabs(tabProperties(tabId,title)))"
+
+
+def tab_ids_by_title(doc):
+    tab_dict = {}
+    pending = list(doc.get("tabs", []))
+    while pending:
+        tab = pending.pop(0)
+        props = tab["tabProperties"]
+        if props["title"] not in tab_dict:
+            tab_dict[props["title"]] = props["tabId"]
+        pending.extend(tab.get("childTabs", []))
+    return tab_dict
+
+
+class DocsPublisher:
+    """Writes city pages into the matching tabs of Google Docs documents.
+
+    Docs clients are built once per worker thread from the cached discovery
+    document and reused, so their HTTP connections stay open. Tab metadata
+    is fetched once per document. Different documents are updated
+    concurrently; writes to the same document keep their original order.
+
+    `service_factory` builds a client; pass one returning a fake service to
+    run the stage without Google.
+    """
+
+    def __init__(self, service_factory=build_docs_service, workers=4, retry_policy=default_policy, journal=None,
+                 metrics=default_metrics):
+        self.service_factory = service_factory
+        self.metrics = metrics
+        self.workers = workers
+        self.retry_policy = retry_policy
+        self.journal = journal
+        self._services = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+        self._tabs = {}
+        self._doc_locks = {}
+
+    def _acquire(self):
+        try:
+            return self._services.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._created < self.workers:
+                self._created += 1
+                return self.service_factory()
+        return self._services.get()
+
+    def _release(self, service):
+        self._services.put(service)
+
+    def _execute(self, service, request_fn):
+        return self.retry_policy.call(lambda: request_fn(service).execute(), endpoint="docs")
+
+    def tabs(self, doc_id):
+        """{tab title: tab id} for `doc_id`, fetched on first use."""
+        with self._lock:
+            doc_lock = self._doc_locks.setdefault(doc_id, threading.Lock())
+        with doc_lock:
+            if doc_id not in self._tabs:
+                service = self._acquire()
+                try:
+                    doc = self._execute(service, lambda s: s.documents().get(
+                        documentId=doc_id, includeTabsContent=True, fields=TAB_FIELDS))
+                finally:
+                    self._release(service)
+                self._tabs[doc_id] = tab_ids_by_title(doc)
+                print(f"Tabs in document {doc_id}: {list(self._tabs[doc_id])}")
+            return self._tabs[doc_id]
+
+    def tab_id(self, doc_id, tab_title):
+        tab_dict = self.tabs(doc_id)
+        if tab_title not in tab_dict:
+            raise KeyError(f"No tab named {tab_title!r} in document {doc_id}")
+        return tab_dict[tab_title]
+
+    def publish_page(self, doc_id, city_name, html, tab_title=None, requests=None):
+        """Write one page into the tab titled `tab_title` (default `city_name`); returns the tab id.
+
+        `requests` already built for that tab (see postprocess.py) replace `html`.
+        """
+        tab_id = self.tab_id(doc_id, tab_title or city_name)
+
+        if requests is None:
+            if callable(html):
+                html = html()
+            with self.metrics.timer(HTML_TO_DOCS, city_name):
+                requests = coalesce_requests(build_requests_from_html(html, tab_id=tab_id))
+        if not requests:
+            print(f"No requests generated for {city_name}.")
+            return tab_id
+
+        service = self._acquire()
+        try:
+            # one batchUpdate per page: Docs applies it atomically, so a retry never doubles a half-written tab
+            with self.metrics.timer(DOCS_BATCH_UPDATE, city_name):
+                self._execute(service, lambda s: s.documents().batchUpdate(
+                    documentId=doc_id, body={"requests": requests}))
+        finally:
+            self._release(service)
+
+        if self.journal:
+            self.journal.record(city_name, "docs-updated", doc_id=doc_id, tab_id=tab_id)
+        print(f"✅ Updated doc tab {city_name} ({tab_id})")
+        return tab_id
+
+    def publish_one(self, doc_id, city_name, html, tab_title=None, requests=None):
+        """publish_page, returning the exception (after logging it) instead of raising."""
+        try:
+            return self.publish_page(doc_id, city_name, html, tab_title, requests)
+        except Exception as e:
+            print(f"❌ Docs update failed for {city_name}: {e}")
+            if self.journal:
+                self.journal.fail(city_name, "docs-updated", e)
+            return e
+
+    def _publish_document(self, doc_id, pages):
+        return {city_name: self.publish_one(doc_id, city_name, html, tab_title) for city_name, html, tab_title in pages}
+
+    def publish(self, jobs):
+        """Publish (doc_id, city_name, html[, tab_title]) jobs; `html` may be a loader callable.
+
+        Returns {(doc_id, city_name): tab id or exception}.
+        """
+        by_doc = {}
+        for doc_id, city_name, html, *tab_title in jobs:
+            by_doc.setdefault(doc_id, []).append((city_name, html, tab_title[0] if tab_title else None))
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            futures = {doc_id: pool.submit(self._publish_document, doc_id, pages) for doc_id, pages in by_doc.items()}
+            for doc_id, future in futures.items():
+                for city_name, result in future.result().items():
+                    results[(doc_id, city_name)] = result
+        return results
@@ -1,21 +1,29 @@
-from openai import OpenAI
 from dotenv import load_dotenv
 import os
 
-load_dotenv()
-API_KEY = os.getenv("DS_API_KEY")
 
-client = OpenAI(
-    api_key=API_KEY,
-    base_url="https://api.deepseek.com"
-)
+def main():
+    # quick DeepSeek check; run it, importing it sends nothing
+    from openai import OpenAI
 
-response = client.chat.completions.create(
-    model="deepseek-chat",
-    messages=[
-        {"role": "user", "content": "Explain quantum computing in simple terms"}
-    ],
-    stream=False
-)
+    load_dotenv()
+    API_KEY = os.getenv("DS_API_KEY")
 
-print(response.choices[0].message.content)
\ No newline at end of file
+    client = OpenAI(
+        api_key=API_KEY,
+        base_url="https://api.deepseek.com"
+    )
+
+    response = client.chat.completions.create(
+        model="deepseek-chat",
+        messages=[
+            {"role": "user", "content": "Explain quantum computing in simple terms"}
+        ],
+        stream=False
+    )
+
+    print(response.choices[0].message.content)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,477 @@
+import os
+import re
+import tempfile
+import time
+
+from cache import request_key
+from dedup import DuplicateContentError
+from metrics import API_LATENCY, FILE_WRITE, PROMPT_BUILD, TTFT, VALIDATION, default_metrics
+from rate_limit import AdaptiveSemaphore, RateLimiter, estimate_tokens, response_headers
+from retry import RATE_LIMIT, ContentError, classify, default_policy
+from store import write_page
+from templates import PromptTooLongError, compile_prompt
+
+
+def record_budget(metrics, city_name, budget):
+    # pre-flight counts; the provider's own cached_tokens land in record_usage
+    metrics.count("prompt_tokens", budget.prompt_tokens, city=city_name)
+    metrics.count("prompt_tokens_cacheable", budget.cacheable_tokens, city=city_name)
+    metrics.count("prompt_tokens_uncached", budget.uncached_tokens, city=city_name)
+
+
+def repair_request(request, sys_msg, repair):
+    # same model and temperature, only the failing part (see validate.PageValidator.plan)
+    return dict(request, messages=build_messages(sys_msg, repair.prompt),
+                max_tokens=min(request["max_tokens"], repair.max_tokens))
+
+
+def repair_tokens(request):
+    # pre-flight estimate for the limiter, like budget.prompt_tokens + max_tokens for a page
+    return sum(estimate_tokens(message["content"]) for message in request["messages"]) + request["max_tokens"]
+
+
+def build_messages(sys_msg, final_prompt):
+    return [
+        {"role": "system", "content": sys_msg},
+        {"role": "user", "content": final_prompt}
+    ]
+
+
+def build_request(model, sys_msg, final_prompt, max_tokens, temperature):
+    # everything that affects the completion; also what the cache key hashes
+    return {
+        "model": model,
+        "messages": build_messages(sys_msg, final_prompt),
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+
+
+MIN_CONTENT_CHARS = 5000
+
+
+def check_content(response, min_chars=MIN_CONTENT_CHARS):
+    """Pull the page out of a chat completion, raising if it is unusable."""
+    choices = response.choices or []
+    if not choices:
+        raise ContentError("API returned no choices.")
+
+    content = choices[0].message.content
+    # Basic validation: ensure we have at least min_chars characters
+    if not content or len(content) < min_chars:
+        raise ContentError("Generated content too short.")
+    return content
+
+
+# openings that mean the model refused instead of writing the page; whole words
+# only, "Chennai can't" or "Delhi cannot" in a heading is not a refusal
+REFUSAL_MARKERS = re.compile(r"\b(i'm sorry|i am sorry|i can['’]?t|i cannot|as an ai)\b")
+
+
+def check_opening(head, expect_html=True):
+    """Fail fast on the first few hundred characters of a streamed page."""
+    opening = head.lstrip().lower()
+    # a refusal is prose before any markup; text inside the page is the page
+    if REFUSAL_MARKERS.search(opening[:200].split("<", 1)[0]):
+        raise ContentError(f"Model refused: {head[:80]!r}")
+    if expect_html and opening and not opening.startswith(("<", "```")):
+        raise ContentError(f"Expected HTML, got: {head[:80]!r}")
+
+
+class PageStream:
+    """Writes a streamed completion to a temp file next to `output_path`.
+
+    The opening is checked as soon as `check_after` characters have arrived
+    so bad generations can be cut off early. `finish` validates the page
+    and renames the temp file into place, so readers never see half a page;
+    `check`, if given, is called with the page before the rename and may
+    raise ContentError, otherwise its result is kept as `verdict`. Without
+    an `output_path` (stores with no file per page) nothing is written and
+    the caller stores what `finish` returns.
+    """
+
+    def __init__(self, output_path, check_after=200, expect_html=True, min_chars=MIN_CONTENT_CHARS, check=None):
+        self.output_path = output_path
+        self.check_after = check_after
+        self.expect_html = expect_html
+        self.min_chars = min_chars
+        self.check = check
+        self.verdict = None
+        self.started = time.time()
+        self.ttft = None
+        self.usage = None
+        self.parts = []
+        self.size = 0
+        self.checked = False
+        self.file = self.tmp_path = None
+        if output_path:
+            fd, self.tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".part")
+            self.file = os.fdopen(fd, "w", encoding="utf-8")
+
+    def feed(self, chunk):
+        if getattr(chunk, "usage", None):
+            self.usage = chunk.usage  # sent on the last chunk with include_usage
+        if not chunk.choices:
+            return
+        text = chunk.choices[0].delta.content
+        if not text:
+            return
+        if self.ttft is None:
+            self.ttft = time.time() - self.started
+        if self.file:
+            self.file.write(text)
+        self.parts.append(text)
+        self.size += len(text)
+        if not self.checked and self.size >= self.check_after:
+            self.checked = True
+            check_opening("".join(self.parts), self.expect_html)
+
+    def finish(self):
+        if self.file:
+            self.file.close()
+        content = "".join(self.parts)
+        try:
+            if not self.checked:
+                check_opening(content, self.expect_html)
+            if len(content) < self.min_chars:
+                raise ContentError("Generated content too short.")
+            if self.check:
+                self.verdict = self.check(content)
+        except ContentError:
+            if self.tmp_path:
+                os.remove(self.tmp_path)
+            raise
+        if self.tmp_path:
+            os.replace(self.tmp_path, self.output_path)
+        return content
+
+    def abort(self):
+        if self.file:
+            self.file.close()
+        if self.tmp_path and os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+async def acreate_completion(client, request, limiter=None, semaphore=None, tokens=0):
+    """Chat completion through the raw-response API, so `limiter` can adopt the x-ratelimit-* headers.
+
+    The headers also drive the AIMD `semaphore` (see rate_limit.AdaptiveSemaphore).
+    """
+    completions = client.chat.completions
+    if not hasattr(completions, "with_raw_response"):
+        response = await completions.create(**request)
+        if semaphore:
+            semaphore.success()
+        return response
+    raw = await completions.with_raw_response.create(**request)
+    info = limiter.observe(raw.headers) if limiter else None
+    if semaphore:
+        semaphore.success(info, tokens)
+    return raw.parse()
+
+
+def check_page(validator, content, city_name, metrics=default_metrics):
+    """Validate a page; raises ContentError unless it passed or only needs a targeted repair."""
+    verdict = validator.check(content, city_name)
+    for check in verdict.failures:
+        metrics.count(f"invalid.{check.name}", city=city_name)
+    if not verdict.ok and not verdict.repairable:
+        raise ContentError(f"Page failed validation: {verdict}")
+    return verdict
+
+
+def check_duplicate(dedup, content, city_name, regenerate=False, metrics=default_metrics):
+    """Index the page in `dedup` (see dedup.DedupIndex); returns the Match it nearly duplicates, if any.
+
+    With `regenerate` a near duplicate raises DuplicateContentError instead
+    and stays out of the index, so the retry draws another sample.
+    """
+    signature = dedup.signature(content, city_name)
+    matches = dedup.similar(signature, exclude=city_name)
+    match = matches[0] if matches else None
+    if match:
+        metrics.count("near_duplicates", city=city_name)
+        if regenerate:
+            raise DuplicateContentError(f"Page is {match.similarity:.0%} similar to the page of {match.key}")
+        print(f"⚠️ {city_name} is {match.similarity:.0%} similar to {match.key}, keeping it flagged")
+    dedup.add(city_name, signature)
+    return match
+
+
+def duplicate_info(match):
+    # extra journal fields for a flagged page
+    return {"near_duplicate": match.key, "similarity": round(match.similarity, 3)} if match else {}
+
+
+class Engine:
+    """Generates city pages concurrently with AsyncOpenAI and writes them to `store`.
+
+    Requests are paced by a RateLimiter at `rpm`/`tpm` and capped by an
+    AdaptiveSemaphore of `concurrency` that grows up to `max_concurrency`
+    (see rate_limit.py). A `router` (see providers.Router) spreads them
+    over several providers instead, each with its own limits; `client`,
+    `concurrency`, `max_concurrency`, `rpm` and `tpm` are then unused.
+    """
+
+    def __init__(self, client, prompt_template, sys_msg, model, max_tokens, store,
+                 temperature=0.5, concurrency=8, rpm=500, tpm=200000, max_concurrency=None,
+                 retry_policy=default_policy, cache=None, journal=None, stream=False,
+                 metrics=default_metrics, router=None, max_prompt_tokens=None, validator=None,
+                 dedup=None, dedup_regenerate=1):
+        self.client = client
+        self.router = router
+        self.metrics = metrics
+        self.stream = stream
+        self.cache = cache
+        self.journal = journal
+        self.prompt = compile_prompt(prompt_template, sys_msg)
+        self.sys_msg = sys_msg
+        self.max_prompt_tokens = max_prompt_tokens
+        self.validator = validator
+        # the validator checks length itself, short pages may be repairable
+        self.min_chars = validator.min_chars // 2 if validator else MIN_CONTENT_CHARS
+        self.model = model
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.store = store
+        self.dedup = dedup
+        self.dedup_regenerate = dedup_regenerate
+        self.retry_policy = retry_policy
+        self.limiter = RateLimiter(rpm, tpm)
+        self.semaphore = AdaptiveSemaphore(concurrency, maximum=max_concurrency)
+
+    async def generate(self, city_name, country_name):
+        """Generate, check and store one city's page; returns its content.
+
+        The request is counted before it is sent and fails without an API
+        call when it would not fit the model (see templates.CompiledPrompt).
+        A `cache` hit skips the API; with `stream` the page is written as it
+        arrives (see PageStream). A page failing the `validator` only in
+        repairable parts gets those parts requested again (see _repair);
+        one too similar to an earlier page (see dedup.DedupIndex) is
+        regenerated up to `dedup_regenerate` times, then kept and flagged.
+        Each finished stage is recorded in the `journal`.
+        """
+        metrics = self.metrics
+        with metrics.timer(PROMPT_BUILD, city_name):
+            final_prompt = self.prompt.render(city_name=city_name, country_name=country_name)
+            request = build_request(self.model, self.sys_msg, final_prompt, self.max_tokens, self.temperature)
+            # only streamed pages are written as they arrive, and only to a FileStore
+            output_path = self.store.file_path(city_name) if self.stream else None
+            key = request_key(request)
+
+        cached = self.cache.get(key) if self.cache else None
+        if self.cache:
+            metrics.count("cache_hits" if cached else "cache_misses", city=city_name)
+        if cached:
+            content = cached[0]
+            match = None
+            if self.dedup:
+                # the cache would only answer with the same page again
+                with metrics.timer(VALIDATION, city_name):
+                    match = check_duplicate(self.dedup, content, city_name, metrics=metrics)
+            if self.journal:
+                self.journal.record(city_name, "generated", cached=True, **duplicate_info(match))
+            location = self._write(city_name, content)
+            print(f'----Cache hit for {city_name}, written to {location}----')
+            return content
+
+        try:
+            models = [p.model for p in self.router.providers] if self.router else [self.model]
+            budgets = [self.prompt.budget(final_prompt, model, self.max_tokens, self.max_prompt_tokens)
+                       for model in models]
+        except PromptTooLongError as e:
+            print(f"❌ Not sending {city_name}: {e}")
+            if self.journal:
+                self.journal.fail(city_name, "generated", e)
+            raise
+        budget = max(budgets, key=lambda b: b.prompt_tokens)
+        record_budget(metrics, city_name, budget)
+        estimated = budget.prompt_tokens + self.max_tokens
+        attempts = 0
+        regenerated = 0
+        match = None
+
+        async def call(client, request, limiter, semaphore):
+            print(f"Calling {request['model']} to generate content for {city_name}...")
+            if self.stream:
+                content, usage, verdict = await self._stream(client, request, output_path, city_name,
+                                                             limiter, semaphore, estimated)
+            else:
+                s_time = time.time()
+                response = await acreate_completion(client, request, limiter, semaphore, estimated)
+                e_time = time.time()
+                metrics.observe(API_LATENCY, e_time - s_time, city_name)
+                usage = response.usage
+                with metrics.timer(VALIDATION, city_name):
+                    content = check_content(response, self.min_chars)
+                    verdict = check_page(self.validator, content, city_name, metrics) if self.validator else None
+                print(f'----Content generated for {city_name} in {e_time - s_time:.1f}s----')
+            metrics.record_usage(city_name, request["model"], usage)
+            return content, usage, request["model"], verdict
+
+        async def attempt():
+            nonlocal attempts, regenerated, match
+            attempts += 1
+            if self.router:
+                provider, result = await self.router.complete(
+                    request, estimated,
+                    lambda provider, request: call(provider.client(), request, provider.limiter, provider.semaphore))
+                client, limiter, semaphore = provider.client(), provider.limiter, provider.semaphore
+                endpoint = f"llm:{provider.name}"
+            else:
+                await self.limiter.wait_async(estimated)
+                async with self.semaphore:
+                    try:
+                        result = await call(self.client, request, self.limiter, self.semaphore)
+                    except Exception as e:
+                        if classify(e) == RATE_LIMIT:
+                            # the Router does the same per provider
+                            self.limiter.observe(response_headers(e))
+                            self.semaphore.throttled()
+                        raise
+                client, limiter, semaphore, endpoint = self.client, self.limiter, self.semaphore, "openai"
+
+            content, usage, model, verdict = result
+            limiter.record_usage(estimated, usage.total_tokens if usage else None)
+            print(f'Usage: {usage}')
+            if verdict and not verdict.ok:
+                # after the page's slot is given back: the repairs queue for their own
+                content = await self._repair(client, dict(request, model=model), content, verdict, city_name,
+                                             country_name, output_path, limiter, semaphore, endpoint)
+            result = content, usage, model
+            if self.dedup:
+                regenerate = regenerated < self.dedup_regenerate
+                try:
+                    with metrics.timer(VALIDATION, city_name):
+                        match = check_duplicate(self.dedup, result[0], city_name, regenerate, metrics)
+                except DuplicateContentError:
+                    regenerated += 1
+                    raise
+            return result
+
+        try:
+            content, usage, model = await self.retry_policy.acall(attempt, endpoint="llm" if self.router else "openai")
+        except Exception as e:
+            print(f"❌ Giving up on {city_name}: {e}")
+            if self.journal:
+                self.journal.fail(city_name, "generated", e)
+            raise
+        finally:
+            metrics.count("retries", max(attempts - 1, 0), city=city_name)
+
+        if self.journal:
+            self.journal.record(city_name, "generated", **duplicate_info(match))
+        if self.cache:
+            try:
+                self.cache.put(key, model, content, usage)
+            except Exception as e:
+                # the page can still be written, only a rerun pays for it again
+                print(f"⚠️ Could not cache {city_name}: {e}")
+        # streamed (and repaired) pages are already in place
+        location = self._write(city_name, content, output_path)
+        print(f'++++written to {location}++++')
+        return content
+
+    def _write(self, city_name, content, location=None):
+        """Store the page unless it is already at `location`; a failure is journaled."""
+        try:
+            if location is None:
+                with self.metrics.timer(FILE_WRITE, city_name):
+                    location = self.store.put(city_name, content)
+        except Exception as e:
+            print(f"❌ Could not write {city_name}: {e}")
+            if self.journal:
+                self.journal.fail(city_name, "written", e)
+            raise
+        if self.journal:
+            self.journal.record(city_name, "written", path=location)
+        return location
+
+    async def _repair(self, client, request, content, verdict, city_name, country_name, output_path,
+                      limiter, semaphore, endpoint):
+        """Request only the failing parts of the page and splice them in.
+
+        Each part is paced by `limiter`, takes a slot of `semaphore` and is
+        retried on its own, so a 429 on a part does not regenerate the page.
+        """
+        import asyncio
+
+        page, repairs = self.validator.plan(content, verdict, city_name, country_name)
+        print(f"Repairing {[repair.part for repair in repairs]} of {city_name}: {verdict}")
+
+        async def send(repair_req):
+            tokens = repair_tokens(repair_req)
+            await limiter.wait_async(tokens)
+            async with semaphore:
+                try:
+                    response = await acreate_completion(client, repair_req, limiter, semaphore, tokens)
+                except Exception as e:
+                    if classify(e) == RATE_LIMIT:
+                        limiter.observe(response_headers(e))
+                        semaphore.throttled()
+                    raise
+            self.metrics.record_usage(city_name, request["model"], response.usage)
+            limiter.record_usage(tokens, response.usage.total_tokens if response.usage else None)
+            return check_content(response, 0)
+
+        fragments = await asyncio.gather(
+            *(self.retry_policy.acall(send, repair_request(request, self.sys_msg, repair), endpoint=endpoint)
+              for repair in repairs))
+        content = self.validator.apply(page, repairs, fragments)
+        with self.metrics.timer(VALIDATION, city_name):
+            verdict = self.validator.check(content, city_name)
+        if not verdict.ok:
+            raise ContentError(f"Page still invalid after repair: {verdict}")
+        self.metrics.count("repairs", city=city_name)
+        if output_path:
+            # the streamed page is already in place, replace it with the repaired one
+            with self.metrics.timer(FILE_WRITE, city_name):
+                write_page(output_path, content)
+        return content
+
+    async def _stream(self, client, request, output_path, city_name, limiter=None, semaphore=None, tokens=0):
+        check = None
+        if self.validator:
+            check = lambda content: check_page(self.validator, content, city_name, self.metrics)
+        page = PageStream(output_path, min_chars=self.min_chars, check=check)
+        response = await acreate_completion(client, dict(request, stream=True, stream_options={"include_usage": True}),
+                                            limiter, semaphore, tokens)
+        try:
+            async for chunk in response:
+                page.feed(chunk)
+            self.metrics.observe(API_LATENCY, time.time() - page.started, city_name)
+            if page.ttft is not None:
+                self.metrics.observe(TTFT, page.ttft, city_name)
+            with self.metrics.timer(VALIDATION, city_name):
+                content = page.finish()
+        except BaseException:
+            page.abort()
+            await response.close()
+            raise
+        ttft = f"{page.ttft:.2f}s" if page.ttft is not None else "n/a"
+        print(f'----Content streamed for {city_name} in {time.time() - page.started:.1f}s (first token {ttft})----')
+        return content, page.usage, page.verdict
+
+    async def run(self, cities, country_name, countries=None):
+        """Generate every city; returns {city: content or exception}.
+
+        `countries` maps cities to their own country, overriding `country_name`.
+        Cities the `journal` has as written are skipped.
+        """
+        import asyncio  # loaded by the generate stage only; batch mode shares this module's helpers
+
+        countries = countries or {}
+        if self.journal:
+            todo = self.journal.pending(cities, "written")
+            if len(todo) < len(cities):
+                print(f"Skipping {len(cities) - len(todo)} cities already written (see {self.journal.path})")
+            cities = todo
+        results = await asyncio.gather(
+            *(self.generate(city_name, countries.get(city_name) or country_name) for city_name in cities),
+            return_exceptions=True
+        )
+        failed = [c for c, r in zip(cities, results) if isinstance(r, Exception)]
+        if failed:
+            print(f"❌ Failed cities: {failed}")
+        return dict(zip(cities, results))
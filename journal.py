@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+import time
+
+# pipeline stages, in the order a city goes through them
+STAGES = ("generated", "written", "docs-updated", "wp-posted")
+
+
+def drop_torn_tail(path, chunk_size=65536):
+    """Cut a half-written last line (from a crash mid-write) off the end of `path`.
+
+    Otherwise the next record would be appended onto it and be lost with it.
+    """
+    with open(path, "rb+") as f:
+        end = f.seek(0, os.SEEK_END)
+        pos = end
+        while pos > 0:
+            start = max(0, pos - chunk_size)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b"\n")
+            if newline >= 0:
+                pos = start + newline + 1
+                break
+            pos = start
+        if pos < end:
+            f.truncate(pos)
+
+
+class Journal:
+    """Append-only JSONL log with one status record per city per stage.
+
+    Replaying the file on start-up tells a restarted run which stages have
+    already completed, so only the unfinished work is redone. Each record is
+    flushed and fsynced before `record` returns, so a crash loses at most
+    the stage that was in progress.
+    """
+
+    def __init__(self, path="job_journal.jsonl"):
+        self.path = path
+        self.completed = set()
+        self.failed = {}
+        self._lock = threading.Lock()
+
+        if os.path.exists(path):
+            drop_torn_tail(path)
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # a corrupt line in the middle; skip it, keep the rest
+                    self._apply(entry)
+
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _apply(self, entry):
+        # the latest record of a (city, stage) wins, so a failed redo undoes an earlier success
+        key = (entry["city"], entry["stage"])
+        if entry["status"] == "done":
+            self.completed.add(key)
+            self.failed.pop(key, None)
+        else:
+            self.completed.discard(key)
+            self.failed[key] = entry.get("error")
+
+    def done(self, city, stage):
+        return (city, stage) in self.completed
+
+    def pending(self, cities, stage):
+        return [city for city in cities if not self.done(city, stage)]
+
+    def record(self, city, stage, status="done", **info):
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage: {stage}")
+        entry = {"ts": time.time(), "city": city, "stage": stage, "status": status}
+        entry.update(info)
+        with self._lock:
+            self._file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._apply(entry)
+
+    def fail(self, city, stage, error):
+        self.record(city, stage, status="failed", error=str(error))
+
+    def close(self):
+        self._file.close()
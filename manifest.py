@@ -0,0 +1,89 @@
+import csv
+import json
+import os
+import zlib
+from collections import namedtuple
+
+# one city to generate and publish; everything but the city is optional and
+# falls back to the command line / env defaults
+Job = namedtuple("Job", "city country tab doc_id page_title key_phrase description",
+                 defaults=(None, None, None, None, None, None))
+
+
+def job_from_row(row):
+    """Job from a manifest row; unknown columns are ignored, empty cells count as missing."""
+    values = {field: (row.get(field) or None) for field in Job._fields}
+    if isinstance(values["city"], str):
+        values["city"] = values["city"].strip() or None
+    if not values["city"]:
+        raise ValueError(f"Manifest row without a city: {row!r}")
+    return Job(**values)
+
+
+def _csv_rows(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        yield from csv.DictReader(f)
+
+
+def _jsonl_rows(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _yaml_rows(path):
+    try:
+        import yaml
+    except ImportError:
+        raise ImportError("YAML manifests need PyYAML (pip install pyyaml); CSV and JSONL work without it")
+    with open(path, encoding="utf-8") as f:
+        # either one list of rows, or one row per "---" document
+        for document in yaml.safe_load_all(f):
+            if isinstance(document, list):
+                yield from document
+            elif document:
+                yield document
+
+
+READERS = {".csv": _csv_rows, ".jsonl": _jsonl_rows, ".ndjson": _jsonl_rows, ".yaml": _yaml_rows, ".yml": _yaml_rows}
+
+
+def read_manifest(path):
+    """Yield a Job per manifest row, reading CSV and JSONL line by line."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"Unsupported manifest {path!r}, expected one of {sorted(READERS)}")
+    for row in READERS[ext](path):
+        yield job_from_row(row)
+
+
+def parse_shard(value):
+    """'i/N' -> (i, N), with shards numbered from 0."""
+    try:
+        index, count = (int(part) for part in value.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, got {value!r}")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in 0..{count - 1}, got {value!r}")
+    return index, count
+
+
+def shard_of(city, count):
+    # crc32 is stable across processes and machines, unlike hash()
+    return zlib.crc32(city.encode("utf-8")) % count
+
+
+def in_shard(jobs, index, count):
+    """The jobs belonging to shard `index` of `count`; every city lands in exactly one shard."""
+    for job in jobs:
+        if shard_of(job.city, count) == index:
+            yield job
+
+
+def shard_path(path, index, count):
+    """Per-shard variant of a state file name: job_journal.jsonl -> job_journal.shard-0-of-4.jsonl."""
+    if not path or count == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{index}-of-{count}{ext}"
@@ -0,0 +1,183 @@
+import csv
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from cache import usage_to_dict
+
+# pipeline stages timed per city, in the order a page goes through them
+PROMPT_BUILD = "prompt_build"
+API_LATENCY = "api_latency"
+TTFT = "ttft"
+VALIDATION = "validation"
+FILE_WRITE = "file_write"
+HTML_TO_DOCS = "html_to_docs"
+DOCS_BATCH_UPDATE = "docs_batch_update"
+WP_POST = "wp_post"
+STAGES = (PROMPT_BUILD, API_LATENCY, TTFT, VALIDATION, FILE_WRITE, HTML_TO_DOCS, DOCS_BATCH_UPDATE, WP_POST)
+
+# USD per 1M tokens: (input, cached input, output); see https://openai.com/api/pricing
+MODEL_PRICES = {
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "gpt-4.1-nano": (0.10, 0.025, 0.40),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "deepseek-chat": (0.27, 0.07, 1.10),
+}
+BATCH_DISCOUNT = 0.5  # the Batch API bills half the list price
+
+PERCENTILES = (50, 90, 99)
+
+
+def percentile(values, q):
+    """Linear-interpolated q-th percentile of already sorted `values`."""
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def price_for(model):
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    # dated snapshots such as gpt-4.1-nano-2025-04-14
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model and model.startswith(name + "-"):
+            return MODEL_PRICES[name]
+    return None
+
+
+def usage_cost(model, usage, batch=False):
+    """(tokens in, cached tokens in, tokens out, USD or None) for a usage object or dict."""
+    usage = usage_to_dict(usage) or {}
+    tokens_in = usage.get("prompt_tokens") or 0
+    tokens_out = usage.get("completion_tokens") or 0
+    cached = (usage_to_dict(usage.get("prompt_tokens_details")) or {}).get("cached_tokens") or 0
+    prices = price_for(model)
+    if prices is None:
+        return tokens_in, cached, tokens_out, None
+    cost = ((tokens_in - cached) * prices[0] + cached * prices[1] + tokens_out * prices[2]) / 1_000_000
+    return tokens_in, cached, tokens_out, cost * (BATCH_DISCOUNT if batch else 1)
+
+
+class Metrics:
+    """Stage timers and counters for one run, overall and per city.
+
+    Every stage observation is kept, so the report can give exact
+    percentiles; a run of a few thousand cities is well under a megabyte.
+    Safe to use from worker threads and from the event loop.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.timings = {}
+        self.counters = {}
+        self.cities = {}
+        self._lock = threading.Lock()
+
+    def _city(self, city):
+        if city not in self.cities:
+            self.cities[city] = {"tokens_in": 0, "cached_tokens_in": 0, "tokens_out": 0, "cost": 0.0}
+        return self.cities[city]
+
+    def observe(self, stage, seconds, city=None):
+        with self._lock:
+            self.timings.setdefault(stage, []).append(seconds)
+            if city is not None:
+                row = self._city(city)
+                row[stage] = row.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def timer(self, stage, city=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, city)
+
+    def count(self, name, n=1, city=None):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+            if city is not None:
+                row = self._city(city)
+                row[name] = row.get(name, 0) + n
+
+    def record_usage(self, city, model, usage, batch=False):
+        tokens_in, cached, tokens_out, cost = usage_cost(model, usage, batch)
+        with self._lock:
+            row = self._city(city)
+            row["tokens_in"] += tokens_in
+            row["cached_tokens_in"] += cached
+            row["tokens_out"] += tokens_out
+            if cost is None:
+                row["cost"] = None
+            elif row["cost"] is not None:
+                row["cost"] += cost
+
+    def summary(self):
+        with self._lock:
+            stages = {}
+            for stage, values in self.timings.items():
+                values = sorted(values)
+                stats = {"count": len(values), "total": sum(values), "mean": sum(values) / len(values)}
+                for q in PERCENTILES:
+                    stats[f"p{q}"] = percentile(values, q)
+                stats["max"] = values[-1]
+                stages[stage] = stats
+            rows = list(self.cities.values())
+            costs = [row["cost"] for row in rows]
+            totals = {
+                "cities": len(rows),
+                "tokens_in": sum(row["tokens_in"] for row in rows),
+                "cached_tokens_in": sum(row["cached_tokens_in"] for row in rows),
+                "tokens_out": sum(row["tokens_out"] for row in rows),
+                "cost": None if None in costs else sum(costs),
+            }
+            return {
+                "started": self.started,
+                "elapsed": time.time() - self.started,
+                "stages": stages,
+                "counters": dict(self.counters),
+                "totals": totals,
+            }
+
+    def write_report(self, json_path="run_metrics.json", csv_path="run_metrics.csv"):
+        """Summary plus per-city rows as JSON, per-city rows as CSV."""
+        report = self.summary()
+        with self._lock:
+            cities = {city: dict(row) for city, row in self.cities.items()}
+        report["cities"] = cities
+
+        if json_path:
+            with open(json_path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+        if csv_path:
+            extra = sorted({key for row in cities.values() for key in row} - set(STAGES) - {"tokens_in", "cached_tokens_in", "tokens_out", "cost"})
+            fields = ["city", "tokens_in", "cached_tokens_in", "tokens_out", "cost"] + list(STAGES) + extra
+            with open(csv_path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=fields, restval="")
+                writer.writeheader()
+                for city, row in cities.items():
+                    writer.writerow(dict(row, city=city))
+        return report
+
+    def print_summary(self, report=None):
+        report = report or self.summary()
+        print(f"\n=== Run metrics ({report['elapsed']:.1f}s) ===")
+        print(f"{'stage':<18}{'count':>7}{'total s':>10}{'p50 s':>9}{'p90 s':>9}{'p99 s':>9}")
+        for stage in sorted(report["stages"], key=lambda s: STAGES.index(s) if s in STAGES else len(STAGES)):
+            stats = report["stages"][stage]
+            print(f"{stage:<18}{stats['count']:>7}{stats['total']:>10.2f}{stats['p50']:>9.3f}"
+                  f"{stats['p90']:>9.3f}{stats['p99']:>9.3f}")
+        totals = report["totals"]
+        cost = f"${totals['cost']:.4f}" if totals["cost"] is not None else "n/a (unknown model price)"
+        print(f"tokens in {totals['tokens_in']} (cached {totals['cached_tokens_in']}), "
+              f"out {totals['tokens_out']}, cost {cost}")
+        if report["counters"]:
+            print("counters: " + ", ".join(f"{name}={value}" for name, value in sorted(report["counters"].items())))
+
+
+default_metrics = Metrics()
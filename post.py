@@ -1,72 +1,355 @@
-import requests
-from requests.auth import HTTPBasicAuth
-from bs4 import BeautifulSoup
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from html.parser import HTMLParser
+from metrics import WP_POST, default_metrics
+from retry import default_policy, retryable_status
 # from logging_config import logger
 # from content import html6
+import hashlib
+import json
 import os
+import re
+import tempfile
+import threading
+import time
+import unicodedata
 
 
+# one result per page handed to WordPressPublisher.publish;
+# action is "created", "updated" or "skipped" (None when the post failed)
+PostResult = namedtuple("PostResult", "key ok status_code post_id link error elapsed action", defaults=(None,))
 
+# post meta holding the hash of what we last sent; it has to be registered for
+# the REST API on the site (register_post_meta with show_in_rest), like the Yoast keys
+CONTENT_HASH_META = "_content_hash"
+INDEX_PAGE_SIZE = 100  # the REST API maximum for per_page
 
-def post_to_wp(html_content, featured_img_url, page_title, brand_name, key_phrase, description, social_image, WP_URL, USERNAME, APP_PASSWORD):
-    """Create a new WordPress post using REST API."""
 
+class _FirstParagraph(HTMLParser):
+    # collects the text of the first <p>, like soup.find("p").get_text(" ", strip=True)
+
+    class Done(Exception):
+        pass
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.depth = 0
+        self.hidden = 0  # inside script/style, not visible text
+        self.found = False
+        self.parts = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "p":
+            self.depth += 1
+            self.found = True
+        elif tag in ("script", "style"):
+            self.hidden += 1
+
+    def handle_endtag(self, tag):
+        if tag == "p" and self.depth:
+            self.depth -= 1
+            if not self.depth:
+                raise self.Done()  # no need to parse the rest of the page
+        elif tag in ("script", "style") and self.hidden:
+            self.hidden -= 1
+
+    def handle_data(self, data):
+        if self.depth and not self.hidden:
+            data = data.strip()
+            if data:
+                self.parts.append(data)
+
+
+def first_paragraph_text(html_content):
+    parser = _FirstParagraph()
     try:
-                            
-        # Content to post (HTML)
-        soup = BeautifulSoup(html_content, "html.parser")
-        first_p = soup.find("p").get_text(" ", strip=True)
-
-        # additional_description = first_p[:85]
-
-        additional_description = first_p[:100]
-        
-        last_space = additional_description.rfind(" ")  # Find the last space before the cutoff
-
-        if last_space != -1:
-            additional_description = additional_description[:last_space]
-
-        full_description = f"{description} {additional_description}"
-
-        # Prepend featured image to content
-        page_content = f'<img src="{featured_img_url}" alt="Featured Image" style="width:100%; height:auto;"/>\n' + html_content
-
-        page_data = {
-            "title": page_title,
-            "content": page_content,
-            "status": "publish",
-            # "featured_media": 9,  Id of the featured image in WordPress media library
-            "meta": {
-                "_yoast_wpseo_focuskw": f"{key_phrase}",
-                "_yoast_wpseo_title": f"{page_title} | {brand_name}",
-                "_yoast_wpseo_metadesc": f"{full_description}",
-                "_yoast_wpseo_opengraph-image": social_image,
-                "_yoast_wpseo_opengraph-title": f"{page_title} | {brand_name}",
-                "_yoast_wpseo_opengraph-description": f"{full_description}",
-                "_yoast_wpseo_twitter-image": social_image,
-                "_yoast_wpseo_twitter-title": f"{page_title} | {brand_name}",
-                "_yoast_wpseo_twitter-description": f"{full_description}"
-            }
+        parser.feed(html_content)
+        parser.close()
+    except _FirstParagraph.Done:
+        pass
+    if not parser.found:
+        raise ValueError("No <p> found in the page content")
+    return " ".join(parser.parts)
+
+
+def build_meta_description(description, first_p):
+    # additional_description = first_p[:85]
+
+    additional_description = first_p[:100]
+
+    last_space = additional_description.rfind(" ")  # Find the last space before the cutoff
+
+    if last_space != -1:
+        additional_description = additional_description[:last_space]
+
+    return f"{description} {additional_description}"
+
+
+def build_page_data(html_content, featured_img_url, page_title, brand_name, key_phrase, description, social_image,
+                    full_description=None):
+    """Request body for the WordPress pages endpoint, with the Yoast SEO fields."""
+    if full_description is None:
+        full_description = build_meta_description(description, first_paragraph_text(html_content))
+
+    # Prepend featured image to content
+    page_content = f'<img src="{featured_img_url}" alt="Featured Image" style="width:100%; height:auto;"/>\n' + html_content
+
+    return {
+        "title": page_title,
+        "content": page_content,
+        "status": "publish",
+        # "featured_media": 9,  Id of the featured image in WordPress media library
+        "meta": {
+            "_yoast_wpseo_focuskw": f"{key_phrase}",
+            "_yoast_wpseo_title": f"{page_title} | {brand_name}",
+            "_yoast_wpseo_metadesc": f"{full_description}",
+            "_yoast_wpseo_opengraph-image": social_image,
+            "_yoast_wpseo_opengraph-title": f"{page_title} | {brand_name}",
+            "_yoast_wpseo_opengraph-description": f"{full_description}",
+            "_yoast_wpseo_twitter-image": social_image,
+            "_yoast_wpseo_twitter-title": f"{page_title} | {brand_name}",
+            "_yoast_wpseo_twitter-description": f"{full_description}"
         }
+    }
+
+
+def slugify(title):
+    """Approximation of WordPress' sanitize_title, used to match existing pages."""
+    slug = unicodedata.normalize("NFKD", title).encode("ascii", "ignore").decode("ascii").lower()
+    slug = re.sub(r"[^a-z0-9\s_-]", "", slug)
+    return re.sub(r"[\s_-]+", "-", slug).strip("-")
+
+
+def content_hash(page_data):
+    canonical = json.dumps(page_data, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def make_session(username, app_password, pool_size=8):
+    # imported here: the page helpers above are also used by worker processes that never post
+    import requests
+    from requests.adapters import HTTPAdapter
+    from requests.auth import HTTPBasicAuth
+
+    session = requests.Session()
+    session.auth = HTTPBasicAuth(username, app_password)
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+class WordPressPublisher:
+    """Publishes pages to the WordPress REST API from a bounded worker pool.
+
+    All workers share one keep-alive Session, so auth and TLS handshakes
+    are paid once per connection rather than once per page. 429 and 5xx
+    answers and network errors are retried by `retry_policy`; every page
+    gets a PostResult instead of an exception.
 
-        response = requests.post(
-            WP_URL,
-            auth=HTTPBasicAuth(USERNAME, APP_PASSWORD),
-            json=page_data,
-            timeout=30
-        )
+    With `upsert=True` existing pages are matched by slug and carry a hash
+    of the content we sent in CONTENT_HASH_META: unchanged pages are
+    skipped, changed ones updated in place and only missing ones created.
+    The slug index is listed once per run and kept in `index_path` for
+    `index_max_age` seconds.
+    """
 
+    def __init__(self, wp_url, username, app_password, featured_img_url=None, social_image=None, brand_name=None,
+                 workers=8, timeout=30, retry_policy=default_policy, journal=None, session=None,
+                 upsert=False, index_path=None, index_max_age=3600, metrics=default_metrics):
+        self.wp_url = wp_url
+        self.featured_img_url = featured_img_url
+        self.social_image = social_image
+        self.brand_name = brand_name
+        self.workers = workers
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.journal = journal
+        self.session = session or make_session(username, app_password, pool_size=workers)
+        self.metrics = metrics
+        self.upsert = upsert
+        self.index_path = index_path
+        self.index_max_age = index_max_age
+        self._index = None
+        self._index_lock = threading.Lock()
+
+    def _send(self, method, url, page_data=None, params=None):
+        response = self.session.request(method, url, json=page_data, params=params, timeout=self.timeout)
+        # raise on 429/5xx so the retry policy backs off and tries again
+        if retryable_status(response.status_code):
+            response.raise_for_status()
+        return response
+
+    def _list_pages(self, page):
+        params = {"per_page": INDEX_PAGE_SIZE, "page": page, "status": "any", "context": "edit",
+                  "_fields": "id,slug,link,meta"}
+        response = self.retry_policy.call(self._send, "GET", self.wp_url, params=params, endpoint="wordpress")
+        response.raise_for_status()
         return response
-    
+
+    def fetch_index(self):
+        """{slug: {"id", "link", "hash"}} for every page on the site, listed 100 at a time."""
+        first = self._list_pages(1)
+        listed = [first.json()]
+        total_pages = int(first.headers.get("X-WP-TotalPages", "1"))
+        if total_pages > 1:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                listed.extend(response.json() for response in pool.map(self._list_pages, range(2, total_pages + 1)))
+
+        index = {}
+        for items in listed:
+            for item in items:
+                meta = item.get("meta") or {}
+                index[item["slug"]] = {"id": item["id"], "link": item.get("link", ""),
+                                       "hash": meta.get(CONTENT_HASH_META) if isinstance(meta, dict) else None}
+        print(f"Indexed {len(index)} existing WordPress pages")
+        return index
+
+    def index(self):
+        """The slug index, from `index_path` while it is fresh, else listed from the site."""
+        with self._index_lock:
+            if self._index is None:
+                path = self.index_path
+                if path and os.path.exists(path) and time.time() - os.path.getmtime(path) < self.index_max_age:
+                    with open(path, encoding="utf-8") as f:
+                        self._index = json.load(f)
+                else:
+                    self._index = self.fetch_index()
+                    self.save_index()
+            return self._index
+
+    def save_index(self):
+        if not self.index_path or self._index is None:
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.index_path) or ".", suffix=".part")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(self._index, f, ensure_ascii=False)
+        os.replace(tmp_path, self.index_path)
+
+    def _upsert(self, page_title, page_data):
+        """Returns (action, response); response is None for skipped pages."""
+        slug = slugify(page_title)
+        digest = content_hash(page_data)
+        existing = self.index().get(slug)
+        if existing and existing["hash"] == digest:
+            return "skipped", None
+
+        page_data = dict(page_data, slug=slug, meta=dict(page_data["meta"], **{CONTENT_HASH_META: digest}))
+        response = None
+        if existing:
+            response = self.retry_policy.call(self._send, "POST", f"{self.wp_url.rstrip('/')}/{existing['id']}",
+                                              page_data, endpoint="wordpress")
+        if response is None or response.status_code == 404:
+            # new page, or the cached index points at one deleted since
+            action = "created"
+            response = self.retry_policy.call(self._send, "POST", self.wp_url, page_data, endpoint="wordpress")
+        else:
+            action = "updated"
+
+        if response.status_code in (200, 201):
+            body = response.json()
+            with self._index_lock:
+                self._index[slug] = {"id": body.get("id"), "link": body.get("link", ""), "hash": digest}
+        return action, response
+
+    def publish_page(self, key, html_content, page_title, key_phrase, description, page_data=None):
+        """Post one page; `html_content` may be a loader callable.
+
+        `page_data` built elsewhere (see postprocess.py) replaces `html_content`.
+        """
+        start = time.time()
+        try:
+            if page_data is None:
+                if callable(html_content):
+                    # read in the worker, so a missing page fails only itself
+                    html_content = html_content()
+                page_data = build_page_data(html_content, self.featured_img_url, page_title, self.brand_name,
+                                            key_phrase, description, self.social_image)
+            with self.metrics.timer(WP_POST, key):
+                if self.upsert:
+                    action, response = self._upsert(page_title, page_data)
+                else:
+                    action = "created"
+                    response = self.retry_policy.call(self._send, "POST", self.wp_url, page_data, endpoint="wordpress")
+        except Exception as e:
+            # logger.error(f"❌ Unexpected error in post_to_wp: {e}")
+            print(f"❌ Posting '{page_title}' to WordPress failed: {e}")
+            if self.journal:
+                self.journal.fail(key, "wp-posted", e)
+            return PostResult(key, False, None, None, None, str(e), time.time() - start)
+
+        if action == "skipped":
+            self.metrics.count("wp_skipped")
+            existing = self.index()[slugify(page_title)]
+            print(f"⏭️ Unchanged page for '{key}': {existing['link']}")
+            if self.journal:
+                self.journal.record(key, "wp-posted", post_id=existing["id"], link=existing["link"], action=action)
+            return PostResult(key, True, None, existing["id"], existing["link"], None, time.time() - start, action)
+
+        if response.status_code not in (200, 201):
+            error = f"HTTP {response.status_code}: {response.text[:200]}"
+            print(f"❌ Posting '{page_title}' to WordPress failed: {error}")
+            if self.journal:
+                self.journal.fail(key, "wp-posted", error)
+            return PostResult(key, False, response.status_code, None, None, error, time.time() - start)
+
+        self.metrics.count(f"wp_{action}")
+        body = response.json()
+        link = body.get("link", "")
+        print(f"✅ {action.capitalize()} page for '{key}': {link}")
+        if self.journal:
+            self.journal.record(key, "wp-posted", post_id=body.get("id"), link=link, action=action)
+        return PostResult(key, True, response.status_code, body.get("id"), link, None, time.time() - start, action)
+
+    def publish(self, pages):
+        """Publish dicts with key, html_content (or a loader), page_title, key_phrase, description
+        (and optionally page_data).
+
+        `pages` may be a generator; at most two pages per worker are held in
+        memory at once. Yields a PostResult per page as each one finishes.
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            in_flight = set()
+            for page in pages:
+                if len(in_flight) >= self.workers * 2:
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+                in_flight.add(pool.submit(self.publish_page, **page))
+            for future in in_flight:
+                yield future.result()
+
+    def close(self):
+        if self.upsert:
+            with self._index_lock:
+                self.save_index()
+        self.session.close()
+
+
+_publishers = {}
+
+
+def post_to_wp(html_content, featured_img_url, page_title, brand_name, key_phrase, description, social_image, WP_URL, USERNAME, APP_PASSWORD):
+    """Create a new WordPress post using REST API."""
+
+    try:
+        # reuse the pooled session for the same site and user
+        publisher = _publishers.get((WP_URL, USERNAME))
+        if publisher is None:
+            publisher = _publishers[(WP_URL, USERNAME)] = WordPressPublisher(WP_URL, USERNAME, APP_PASSWORD, workers=1)
+
+        page_data = build_page_data(html_content, featured_img_url, page_title, brand_name, key_phrase, description, social_image)
+        return default_policy.call(publisher._send, "POST", WP_URL, page_data, endpoint="wordpress")
+
     # except requests.exceptions.Timeout:
     #     logger.error(f"⏰ Timeout while posting '{page_title}' to WordPress.")
     # except requests.exceptions.RequestException as re:
     #     logger.error(f"🌐 Request error during post_to_wp for '{page_title}': {re}")
     except Exception as e:
         # logger.error(f"❌ Unexpected error in post_to_wp: {e}")
-        print("❌ Unexpected error in post_to_wp: {e}")
+        print(f"❌ Unexpected error in post_to_wp: {e}")
 
     return None
 
 
-# print(post_to_wp(html_content, featured_img_url, page_title, brand_name, key_phrase, description, social_image, WP_URL, USERNAME, APP_PASSWORD))
\ No newline at end of file
+# print(post_to_wp(html_content, featured_img_url, page_title, brand_name, key_phrase, description, social_image, WP_URL, USERNAME, APP_PASSWORD))
@@ -0,0 +1,202 @@
+import os
+import queue
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+from metrics import HTML_TO_DOCS, default_metrics
+from post import _FirstParagraph, build_meta_description, build_page_data, first_paragraph_text
+from store import read_location
+from write_doc import HtmlToDocsParser, coalesce_requests
+
+# one written page to publish, `location` as returned by the page store (see
+# store.read_location); doc_id None skips Docs, wp None skips WordPress.
+# wp is (page_title, key_phrase, description)
+PostJob = namedtuple("PostJob", "city location doc_id tab_title wp", defaults=(None, None, None))
+# what a worker process sends back: Docs requests, WordPress page body, seconds spent on the Docs requests
+ProcessedPage = namedtuple("ProcessedPage", "docs_requests page_data docs_seconds")
+
+
+class _PageParser(HtmlToDocsParser):
+    """HtmlToDocsParser that also picks up the first paragraph on the same pass, for the meta description."""
+
+    def __init__(self, tab_id):
+        super().__init__(tab_id=tab_id)
+        self.first = _FirstParagraph()
+        self.first_done = False
+
+    def _first(self, method, *args):
+        if not self.first_done:
+            try:
+                getattr(self.first, method)(*args)
+            except _FirstParagraph.Done:
+                self.first_done = True
+
+    def handle_starttag(self, tag, attrs):
+        self._first("handle_starttag", tag, attrs)
+        super().handle_starttag(tag, attrs)
+
+    def handle_startendtag(self, tag, attrs):
+        self._first("handle_startendtag", tag, attrs)
+        super().handle_startendtag(tag, attrs)
+
+    def handle_endtag(self, tag):
+        self._first("handle_endtag", tag)
+        super().handle_endtag(tag)
+
+    def handle_data(self, data):
+        self._first("handle_data", data)
+        super().handle_data(data)
+
+    def first_paragraph(self):
+        if not self.first.found:
+            raise ValueError("No <p> found in the page content")
+        return " ".join(self.first.parts)
+
+
+def process_page(task):
+    """Runs in a worker process: read one page and build everything the I/O stages send.
+
+    `task` is (location, tab_id or None, wp fields or None), wp fields being the
+    build_page_data arguments after the html.
+    """
+    location, tab_id, wp = task
+    html = read_location(location)
+    docs_requests = first_p = docs_seconds = None
+    if tab_id is not None:
+        start = time.perf_counter()
+        parser = _PageParser(tab_id)
+        parser.feed(html)
+        parser.close()
+        docs_requests = coalesce_requests(parser.result())
+        docs_seconds = time.perf_counter() - start
+        if wp:
+            first_p = parser.first_paragraph()
+
+    page_data = None
+    if wp:
+        featured_img_url, page_title, brand_name, key_phrase, description, social_image = wp
+        if first_p is None:
+            first_p = first_paragraph_text(html)
+        page_data = build_page_data(html, featured_img_url, page_title, brand_name, key_phrase, description,
+                                    social_image, full_description=build_meta_description(description, first_p))
+    return ProcessedPage(docs_requests, page_data, docs_seconds)
+
+
+class PostProcessor:
+    """Builds the Docs requests and WordPress bodies of many pages on a process pool.
+
+    Each page is parsed once in a worker process, and the results go to the
+    Docs and WordPress stages through bounded queues. When a stage falls
+    behind, its queue fills and no new pages are handed to the pool, so
+    memory stays flat on thousand-page runs while the network workers of
+    both stages are kept busy. Every document is owned by one Docs worker,
+    so its tabs are written in job order. Either publisher may be None to
+    skip it.
+    """
+
+    def __init__(self, docs_publisher=None, wp_publisher=None, workers=None, queue_size=64, metrics=default_metrics):
+        self.docs_publisher = docs_publisher
+        self.wp_publisher = wp_publisher
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.metrics = metrics
+        self._doc_workers = {}  # doc_id -> index of the Docs worker that owns it
+
+    def _task(self, job, docs_results):
+        tab_id = wp = None
+        if self.docs_publisher and job.doc_id:
+            # a missing tab only fails the Docs stage, the page can still be posted
+            try:
+                tab_id = self.docs_publisher.tab_id(job.doc_id, job.tab_title or job.city)
+            except Exception as e:
+                print(f"❌ Docs update failed for {job.city}: {e}")
+                if self.docs_publisher.journal:
+                    self.docs_publisher.journal.fail(job.city, "docs-updated", e)
+                docs_results[(job.doc_id, job.city)] = e
+        if self.wp_publisher and job.wp:
+            page_title, key_phrase, description = job.wp
+            publisher = self.wp_publisher
+            wp = (publisher.featured_img_url, page_title, publisher.brand_name, key_phrase, description,
+                  publisher.social_image)
+        if tab_id is None and wp is None:
+            return None
+        return (job.location, tab_id, wp)
+
+    def _fail(self, job, task, error):
+        print(f"❌ Post-processing failed for {job.city}: {error}")
+        if task[1] is not None and self.docs_publisher.journal:
+            self.docs_publisher.journal.fail(job.city, "docs-updated", error)
+        if task[2] is not None and self.wp_publisher.journal:
+            self.wp_publisher.journal.fail(job.city, "wp-posted", error)
+
+    def _docs_worker(self, docs_queue, results):
+        for job, docs_requests in iter(docs_queue.get, None):
+            results[(job.doc_id, job.city)] = self.docs_publisher.publish_one(
+                job.doc_id, job.city, None, job.tab_title, requests=docs_requests)
+
+    def _docs_queue(self, docs_queues, doc_id):
+        # documents go round-robin to the workers, then stay with theirs
+        # (one batchUpdate at a time per document, like DocsPublisher.publish)
+        index = self._doc_workers.setdefault(doc_id, len(self._doc_workers) % len(docs_queues))
+        return docs_queues[index]
+
+    def _wp_worker(self, wp_queue, results):
+        results.extend(self.wp_publisher.publish(iter(wp_queue.get, None)))
+
+    def _dispatch(self, job, task, future, docs_queues, wp_queue, docs_results):
+        try:
+            processed = future.result()
+        except Exception as e:
+            self._fail(job, task, e)
+            if task[1] is not None:
+                docs_results[(job.doc_id, job.city)] = e
+            return
+        if processed.docs_seconds is not None:
+            self.metrics.observe(HTML_TO_DOCS, processed.docs_seconds, job.city)
+        # put() blocks while a stage is behind, which holds back the pool
+        if processed.docs_requests is not None:
+            self._docs_queue(docs_queues, job.doc_id).put((job, processed.docs_requests))
+        if processed.page_data is not None:
+            page_title, key_phrase, description = job.wp
+            wp_queue.put({"key": job.city, "html_content": None, "page_title": page_title,
+                          "key_phrase": key_phrase, "description": description, "page_data": processed.page_data})
+
+    def run(self, jobs):
+        """Process and publish PostJobs; returns ({(doc_id, city): tab id or exception}, [PostResult])."""
+        docs_queues = []
+        if self.docs_publisher:
+            docs_queues = [queue.Queue(self.queue_size) for _ in range(self.docs_publisher.workers)]
+        self._doc_workers = {}
+        wp_queue = queue.Queue(self.queue_size)
+        docs_results, wp_results = {}, []
+        threads = [threading.Thread(target=self._docs_worker, args=(docs_queue, docs_results), daemon=True)
+                   for docs_queue in docs_queues]
+        if self.wp_publisher:
+            threads.append(threading.Thread(target=self._wp_worker, args=(wp_queue, wp_results), daemon=True))
+        for thread in threads:
+            thread.start()
+
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers) as pool:
+                in_flight = {}
+                for job in jobs:
+                    task = self._task(job, docs_results)
+                    if task is None:
+                        continue
+                    if len(in_flight) >= self.workers * 2:
+                        # oldest first, so the publishers get the pages in job order
+                        future = next(iter(in_flight))
+                        self._dispatch(*in_flight.pop(future), future, docs_queues, wp_queue, docs_results)
+                    in_flight[pool.submit(process_page, task)] = (job, task)
+                for future, (job, task) in in_flight.items():
+                    self._dispatch(job, task, future, docs_queues, wp_queue, docs_results)
+        finally:
+            for docs_queue in docs_queues:
+                docs_queue.put(None)
+            if self.wp_publisher:
+                wp_queue.put(None)
+            for thread in threads:
+                thread.join()
+        return docs_results, wp_results
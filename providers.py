@@ -0,0 +1,194 @@
+import json
+import os
+import random
+import time
+
+from metrics import default_metrics, price_for
+from rate_limit import AdaptiveSemaphore, RateLimiter, response_headers
+from retry import INVALID_OUTPUT, RATE_LIMIT, TRANSIENT, CircuitOpenError, classify, get_breaker, retry_after, status_of
+
+# providers known by name; anything here can be overridden from env or the config file
+BUILTIN_PROVIDERS = {
+    "openai": {"model": "gpt-4.1-nano", "api_key_env": "OPENAI_API_KEY"},
+    "deepseek": {"model": "deepseek-chat", "base_url": "https://api.deepseek.com", "api_key_env": "DS_API_KEY"},
+}
+# how long a provider that answered 429 without Retry-After is tried last
+DEFAULT_COOLDOWN = 5.0
+
+
+class Provider:
+    """One OpenAI-compatible endpoint (OpenAI itself, DeepSeek via base_url, ...).
+
+    Each provider paces itself with its own requests/tokens per minute and
+    caps its own requests in flight. Both adapt as the run goes: the
+    limits follow the endpoint's x-ratelimit-* headers and the cap starts
+    at `concurrency` and moves by AIMD up to `max_concurrency` (see
+    rate_limit.AdaptiveSemaphore). Clients are created on first use.
+    """
+
+    def __init__(self, name, model, base_url=None, api_key_env="OPENAI_API_KEY", concurrency=8,
+                 rpm=500, tpm=200000, weight=1.0, price=None, client=None, max_concurrency=None):
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.api_key_env = api_key_env
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.weight = weight
+        self.price = tuple(price) if price else price_for(model)
+        self.limiter = RateLimiter(rpm, tpm)
+        self.breaker = get_breaker(f"llm:{name}")
+        self.cooldown_until = 0.0
+        self._client = client
+        self._sync_client = None
+        self._semaphore = None
+
+    def __repr__(self):
+        return f"Provider({self.name!r}, {self.model!r})"
+
+    def client(self):
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=os.getenv(self.api_key_env), base_url=self.base_url)
+        return self._client
+
+    def sync_client(self):
+        if self._sync_client is None:
+            from openai import OpenAI
+            self._sync_client = OpenAI(api_key=os.getenv(self.api_key_env), base_url=self.base_url)
+        return self._sync_client
+
+    @property
+    def semaphore(self):
+        # created lazily so it binds to the running event loop
+        if self._semaphore is None:
+            self._semaphore = AdaptiveSemaphore(self.concurrency, maximum=self.max_concurrency)
+        return self._semaphore
+
+    def cost_rank(self):
+        # blended input + output price; unknown prices go last
+        return self.price[0] + self.price[2] if self.price else float("inf")
+
+
+def provider_from_config(name, config):
+    config = dict(BUILTIN_PROVIDERS.get(name, {}), **config)
+    if "model" not in config:
+        raise ValueError(f"Provider {name!r} needs a model")
+    return Provider(name, **config)
+
+
+def _env_config(name):
+    # OPENAI_MODEL, DEEPSEEK_BASE_URL, DEEPSEEK_RPM, ... override the built-in defaults
+    prefix = name.upper().replace("-", "_") + "_"
+    casts = {"MODEL": str, "BASE_URL": str, "API_KEY_ENV": str, "CONCURRENCY": int, "MAX_CONCURRENCY": int,
+             "RPM": int, "TPM": int, "WEIGHT": float}
+    config = {}
+    for key, cast in casts.items():
+        value = os.getenv(prefix + key)
+        if value:
+            config[key.lower()] = cast(value)
+    return config
+
+
+def load_providers(path=None, names=None, defaults=None):
+    """Providers from a JSON config file, else from env.
+
+    The file looks like {"routing": "cost", "providers": [{"name": "openai",
+    "model": "gpt-4.1-nano", "rpm": 500, ...}, ...]}. Without a file,
+    `names` (e.g. "openai,deepseek") are taken from BUILTIN_PROVIDERS with
+    <NAME>_MODEL, <NAME>_BASE_URL, <NAME>_CONCURRENCY, <NAME>_MAX_CONCURRENCY,
+    <NAME>_RPM, <NAME>_TPM and <NAME>_WEIGHT overrides; `defaults` apply to all of them
+    first. Returns (providers, routing or None).
+    """
+    if path:
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        providers = [provider_from_config(item.pop("name"), item) for item in config["providers"]]
+        return providers, config.get("routing")
+
+    providers = []
+    for name in (names or "openai").split(","):
+        name = name.strip()
+        if name:
+            providers.append(provider_from_config(name, dict(defaults or {}, **_env_config(name))))
+    return providers, None
+
+
+class Router:
+    """Sends each request to one of several providers, failing over on throttling.
+
+    With "weight" routing providers are tried in a random order drawn by
+    weight; with "cost" the cheapest is tried first. A provider that
+    answers 429 is moved to the back of the line for its Retry-After (or
+    DEFAULT_COOLDOWN) and has its requests in flight cut, and one whose
+    circuit breaker is open (after network errors and 5xx, not 429s) is
+    skipped, so a throttled provider does not stall the run while others
+    have capacity. Only when every provider has failed is the last error
+    raised, for the retry policy to back off on.
+    """
+
+    def __init__(self, providers, routing="weight", metrics=default_metrics, seed=None):
+        if not providers:
+            raise ValueError("Router needs at least one provider")
+        if routing not in ("weight", "cost"):
+            raise ValueError(f"Unknown routing {routing!r}, expected 'weight' or 'cost'")
+        self.providers = list(providers)
+        self.routing = routing
+        self.metrics = metrics
+        self.rng = random.Random(seed)
+
+    @property
+    def concurrency(self):
+        return sum(provider.concurrency for provider in self.providers)
+
+    def order(self):
+        if self.routing == "cost":
+            ordered = sorted(self.providers, key=lambda p: (p.cost_rank(), -p.weight))
+        else:
+            pool, ordered = list(self.providers), []
+            while pool:
+                pick = self.rng.choices(pool, weights=[max(p.weight, 1e-9) for p in pool])[0]
+                pool.remove(pick)
+                ordered.append(pick)
+        now = time.monotonic()
+        # stable sort: providers cooling down after a 429 go last, then those with no free slot
+        return sorted(ordered, key=lambda p: (p.cooldown_until > now, p.semaphore.locked()))
+
+    async def complete(self, request, estimated, call):
+        """Await `call(provider, request)` with the provider's model filled in.
+
+        Returns (provider, result).
+        """
+        last_error = None
+        for provider in self.order():
+            try:
+                provider.breaker.before_call()
+            except CircuitOpenError as e:
+                last_error = e
+                continue
+            await provider.limiter.wait_async(estimated)
+            async with provider.semaphore:
+                try:
+                    result = await call(provider, dict(request, model=provider.model))
+                except Exception as e:
+                    kind = classify(e)
+                    if kind == TRANSIENT:
+                        provider.breaker.record_failure()
+                    elif kind == INVALID_OUTPUT or status_of(e) is not None:
+                        provider.breaker.record_success()  # it answered (429s too), it is up
+                    if kind not in (RATE_LIMIT, TRANSIENT):
+                        raise
+                    if kind == RATE_LIMIT:
+                        provider.cooldown_until = time.monotonic() + (retry_after(e) or DEFAULT_COOLDOWN)
+                        provider.limiter.observe(response_headers(e))
+                        limit = provider.semaphore.throttled()
+                        if limit:
+                            print(f"[{provider.name}] throttled, now at most {int(limit)} requests in flight")
+                    self.metrics.count(f"failovers.{provider.name}")
+                    print(f"[{provider.name}] {kind}, trying the next provider: {e}")
+                    last_error = e
+                    continue
+            provider.breaker.record_success()
+            self.metrics.count(f"requests.{provider.name}")
+            return provider, result
+        raise last_error
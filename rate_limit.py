@@ -0,0 +1,230 @@
+import re
+import threading
+import time
+from collections import namedtuple
+
+# what an OpenAI-compatible endpoint reports in its x-ratelimit-* headers;
+# limits are per minute, resets in seconds, None when the header is missing
+RateLimitInfo = namedtuple("RateLimitInfo",
+                           "limit_requests limit_tokens remaining_requests remaining_tokens reset_requests reset_tokens")
+# "6m0s", "1.5s", "20ms", "1h2m"
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+DURATION_SECONDS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def estimate_tokens(text):
+    # rough offline estimate: ~4 characters per token for English text
+    return len(text) // 4 + 1
+
+
+def parse_duration(value):
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_SECONDS[unit] for number, unit in parts)
+
+
+def _header_int(headers, name):
+    value = headers.get(name)
+    try:
+        return int(float(value)) if value is not None else None
+    except ValueError:
+        return None
+
+
+def rate_limit_info(headers):
+    """RateLimitInfo from a response's headers, or None if it sent no x-ratelimit-* headers."""
+    if not headers:
+        return None
+    info = RateLimitInfo(
+        _header_int(headers, "x-ratelimit-limit-requests"), _header_int(headers, "x-ratelimit-limit-tokens"),
+        _header_int(headers, "x-ratelimit-remaining-requests"), _header_int(headers, "x-ratelimit-remaining-tokens"),
+        parse_duration(headers.get("x-ratelimit-reset-requests")),
+        parse_duration(headers.get("x-ratelimit-reset-tokens")))
+    return info if any(value is not None for value in info) else None
+
+
+def response_headers(exc):
+    # headers of the response an openai APIStatusError (e.g. a 429) came with
+    response = getattr(exc, "response", None)
+    return getattr(response, "headers", None) if response is not None else None
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at `rate_per_minute`.
+
+    A reservation is taken right away (the level may go negative) and gets
+    a ticket, the running total reserved up to and including it; it is
+    covered once the running total paid in reaches the ticket, so
+    reservations are served in call order and nobody starves. Waiting on
+    the ticket rather than on a delay fixed at reservation time means a
+    rate raised later (see sync) also speeds up the callers already queued.
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.reserved = 0.0
+        self.paid = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    @property
+    def level(self):
+        return self.paid - self.reserved
+
+    def _refill(self, now):
+        self.paid = min(self.reserved + self.capacity, self.paid + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Take `amount`; returns the ticket to pass to delay()."""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.reserved += amount
+            return self.reserved
+
+    def delay(self, ticket):
+        """Seconds until `ticket` is covered at the current rate."""
+        with self._lock:
+            self._refill(time.monotonic())
+            return max(0.0, (ticket - self.paid) / self.rate)
+
+    def adjust(self, delta):
+        # positive delta gives tokens back, negative charges extra
+        with self._lock:
+            self._refill(time.monotonic())
+            self.paid = min(self.reserved + self.capacity, self.paid + delta)
+
+    def sync(self, limit=None, remaining=None, reset=None):
+        """Follow what the server reports: its per-minute `limit` and what is `remaining` of it."""
+        with self._lock:
+            self._refill(time.monotonic())
+            if limit:
+                self.rate = limit / 60.0
+                self.capacity = limit
+                self.paid = min(self.paid, self.reserved + limit)
+            if remaining is not None:
+                # nothing left: the next reservation waits until the server's reset
+                server = remaining if remaining > 0 or not reset else -reset * self.rate
+                self.paid = min(self.paid, self.reserved + server)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits for one endpoint."""
+
+    # waiters wake up at least this often, to follow a rate changed by observe()
+    RECHECK_INTERVAL = 1.0
+
+    def __init__(self, rpm, tpm):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+
+    def reserve(self, tokens):
+        return self.requests.reserve(1), self.tokens.reserve(tokens)
+
+    def delay(self, tickets):
+        return max(self.requests.delay(tickets[0]), self.tokens.delay(tickets[1]))
+
+    def wait(self, tokens):
+        tickets = self.reserve(tokens)
+        delay = self.delay(tickets)
+        while delay > 0:
+            time.sleep(min(delay, self.RECHECK_INTERVAL))
+            delay = self.delay(tickets)
+
+    async def wait_async(self, tokens):
+        import asyncio
+
+        tickets = self.reserve(tokens)
+        delay = self.delay(tickets)
+        while delay > 0:
+            await asyncio.sleep(min(delay, self.RECHECK_INTERVAL))
+            delay = self.delay(tickets)
+
+    def record_usage(self, estimated, actual):
+        # settle the difference between the pre-flight estimate and the
+        # tokens the API actually billed
+        if actual is not None:
+            self.tokens.adjust(estimated - actual)
+
+    def observe(self, headers):
+        """Adopt the limits an endpoint reports in its x-ratelimit-* headers; returns the RateLimitInfo.
+
+        The configured rpm/tpm are only the starting point, so pacing ends
+        up at the account's real quota for the model without tuning.
+        """
+        info = rate_limit_info(headers)
+        if info:
+            self.requests.sync(info.limit_requests, info.remaining_requests, info.reset_requests)
+            self.tokens.sync(info.limit_tokens, info.remaining_tokens, info.reset_tokens)
+        return info
+
+
+class AdaptiveSemaphore:
+    """asyncio.Semaphore whose size follows the endpoint, by AIMD as in TCP congestion control.
+
+    Each success grows the limit by `increase` / limit (about `increase`
+    per full round of requests) while the endpoint reports quota to
+    spare; a 429 multiplies it by `decrease`, at most once per `cooldown`
+    seconds so a burst of 429s from one overload counts once. The limit
+    stays within `minimum` and `maximum` (default 4x the starting limit).
+    """
+
+    def __init__(self, limit, minimum=1, maximum=None, increase=1.0, decrease=0.5, cooldown=2.0):
+        self.limit = float(limit)
+        self.minimum = minimum
+        self.maximum = maximum or limit * 4
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self._decreased = 0.0
+        self._condition = None
+
+    @property
+    def condition(self):
+        # created lazily so it binds to the running event loop
+        if self._condition is None:
+            import asyncio
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    def locked(self):
+        return self.in_flight >= int(self.limit)
+
+    async def __aenter__(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self.condition:
+            self.in_flight -= 1
+            # also wakes the waiters a grown limit lets in
+            self.condition.notify_all()
+
+    def success(self, info=None, tokens=0):
+        """Additive increase, unless `info` (RateLimitInfo) shows the quota would not cover more requests."""
+        if info is not None:
+            if info.remaining_requests is not None and info.remaining_requests <= self.in_flight:
+                return
+            if info.remaining_tokens is not None and info.remaining_tokens < tokens * self.in_flight:
+                return
+        self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+
+    def throttled(self):
+        """Multiplicative decrease; returns the new limit, or None within the cooldown of the last one."""
+        now = time.monotonic()
+        if now - self._decreased < self.cooldown:
+            return None
+        self._decreased = now
+        self.limit = max(self.minimum, self.limit * self.decrease)
+        return self.limit
@@ -0,0 +1,238 @@
+import random
+import threading
+import time
+
+from metrics import default_metrics
+
+# error classes returned by classify()
+RATE_LIMIT = "rate_limit"
+TRANSIENT = "transient"
+INVALID_OUTPUT = "invalid_output"
+CIRCUIT_OPEN = "circuit_open"
+FATAL = "fatal"
+
+RETRYABLE = (RATE_LIMIT, TRANSIENT, INVALID_OUTPUT, CIRCUIT_OPEN)
+TRANSIENT_STATUSES = (408, 409, 500, 502, 503, 504)
+# network-level errors of the clients we use (openai, httpx, requests, httplib2),
+# matched by name so this module does not have to import any of them
+TRANSIENT_ERROR_NAMES = {
+    "APIConnectionError", "APITimeoutError", "TransportError", "TimeoutException",
+    "ConnectionError", "Timeout", "ChunkedEncodingError", "ServerNotFoundError",
+}
+
+
+class ContentError(RuntimeError):
+    """The API answered but the generated content is unusable."""
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised without calling the endpoint while its circuit breaker is open.
+
+    `retry_after` is the number of seconds until the breaker lets a trial call through.
+    """
+
+    def __init__(self, message, retry_after=0.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def status_of(exc):
+    # openai / newer googleapiclient expose status_code, requests has
+    # exc.response.status_code, httplib2 responses have .status
+    status = getattr(exc, "status_code", None)
+    if status is None and getattr(exc, "response", None) is not None:
+        status = getattr(exc.response, "status_code", None)
+    if status is None and getattr(exc, "resp", None) is not None:
+        status = getattr(exc.resp, "status", None)
+    try:
+        return int(status) if status is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def retryable_status(status):
+    return status is not None and (status == 429 or status in TRANSIENT_STATUSES or status >= 500)
+
+
+def classify(exc):
+    if isinstance(exc, ContentError):
+        return INVALID_OUTPUT
+    if isinstance(exc, CircuitOpenError):
+        return CIRCUIT_OPEN
+    status = status_of(exc)
+    if status == 429:
+        return RATE_LIMIT
+    if status is not None:
+        return TRANSIENT if retryable_status(status) else FATAL
+    if isinstance(exc, (ConnectionError, TimeoutError)):
+        return TRANSIENT
+    if any(cls.__name__ in TRANSIENT_ERROR_NAMES for cls in type(exc).__mro__):
+        return TRANSIENT
+    return FATAL
+
+
+def retry_after(exc):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None."""
+    headers = None
+    if getattr(exc, "response", None) is not None:
+        headers = getattr(exc.response, "headers", None)
+    if headers is None and getattr(exc, "resp", None) is not None:
+        headers = exc.resp  # httplib2 response is a dict of lower-cased headers
+    if not headers:
+        return None
+
+    value = headers.get("retry-after-ms")
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    import email.utils  # HTTP-date form, rare next to seconds
+
+    try:
+        parsed = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+class CircuitBreaker:
+    """Stops calling an endpoint after `threshold` consecutive failures.
+
+    After `reset_timeout` seconds one trial call is let through (half-open);
+    success closes the circuit again, failure re-opens it.
+    """
+
+    def __init__(self, name, threshold=5, reset_timeout=60.0):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(f"Circuit for {self.name} is open after {self.failures} failures", remaining)
+            # half-open: let this call through, keep others out until it reports back
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"⚠️ Circuit for {self.name} opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(endpoint):
+    with _breakers_lock:
+        if endpoint not in _breakers:
+            _breakers[endpoint] = CircuitBreaker(endpoint)
+        return _breakers[endpoint]
+
+
+class RetryPolicy:
+    """Retries transient errors with exponential backoff and full jitter.
+
+    Rate limits honour the server's Retry-After when it sends one.
+    Failures of the endpoint itself (5xx, network errors) count towards
+    its circuit breaker; 429s do not, a throttled endpoint is up and
+    Retry-After and the adaptive concurrency already slow us down. While
+    the breaker is open, calls wait until it lets a trial call through.
+    """
+
+    def __init__(self, max_attempts=4, base=1.0, cap=60.0, max_invalid_output=2, metrics=default_metrics):
+        self.max_attempts = max_attempts
+        self.metrics = metrics
+        self.base = base
+        self.cap = cap
+        self.max_invalid_output = max_invalid_output
+
+    def backoff(self, attempt):
+        return random.uniform(0, min(self.cap, self.base * 2 ** (attempt - 1)))
+
+    def _next_delay(self, exc, kind, attempt, invalid_outputs, breaker):
+        """Delay before the next attempt, or None if `exc` should be raised."""
+        if kind == TRANSIENT:
+            breaker.record_failure()
+        elif kind == INVALID_OUTPUT or status_of(exc) is not None:
+            breaker.record_success()  # the endpoint answered (429s too), it is healthy
+        if kind not in RETRYABLE or attempt >= self.max_attempts:
+            return None
+        if kind == INVALID_OUTPUT:
+            # the endpoint is fine, the sample was bad: retry straight away
+            return None if invalid_outputs > self.max_invalid_output else 0.0
+        delay = self.backoff(attempt)
+        if kind == RATE_LIMIT:
+            delay = max(delay, retry_after(exc) or 0.0)
+        elif kind == CIRCUIT_OPEN:
+            # the backoff on top spreads the waiters out, only one gets the trial call
+            delay += exc.retry_after
+        return delay
+
+    def call(self, fn, *args, endpoint="default", **kwargs):
+        breaker = get_breaker(endpoint)
+        invalid_outputs = 0
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                breaker.before_call()
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                invalid_outputs += kind == INVALID_OUTPUT
+                delay = self._next_delay(e, kind, attempt, invalid_outputs, breaker)
+                print(f"[{endpoint}] attempt {attempt} failed ({kind}): {e}")
+                if delay is None:
+                    raise
+                self.metrics.count(f"retries.{endpoint}")
+                time.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+    async def acall(self, fn, *args, endpoint="default", **kwargs):
+        import asyncio  # only async callers need it; the Docs/WordPress threads never load it
+
+        breaker = get_breaker(endpoint)
+        invalid_outputs = 0
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                breaker.before_call()
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                kind = classify(e)
+                invalid_outputs += kind == INVALID_OUTPUT
+                delay = self._next_delay(e, kind, attempt, invalid_outputs, breaker)
+                print(f"[{endpoint}] attempt {attempt} failed ({kind}): {e}")
+                if delay is None:
+                    raise
+                self.metrics.count(f"retries.{endpoint}")
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+
+default_policy = RetryPolicy()
@@ -0,0 +1,195 @@
+import hashlib
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from urllib.parse import quote, unquote
+
+# file name of a city's page; takes {city_slug} and {city_name}
+OUTPUT_PATTERN = "{city_slug}_seo_page3.txt"
+SQLITE_PREFIX = "sqlite://"
+# let SQLite map up to this much of the store into memory for reads
+MMAP_SIZE = 256 * 1024 * 1024
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 9
+
+
+def output_path_for(city_name, output_dir=".", pattern=OUTPUT_PATTERN):
+    filename_safe = city_name.lower().replace(" ", "_")
+    return os.path.join(output_dir, pattern.format(city_slug=filename_safe, city_name=city_name))
+
+
+def write_page(output_path, content):
+    # write next to the target and rename, so a crash never leaves half a page
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(output_path) or ".", suffix=".part")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def read_page(output_path):
+    with open(output_path, encoding="utf-8") as f:
+        return f.read()
+
+
+def _compress(data):
+    try:
+        import zstandard
+    except ImportError:
+        return "zlib", zlib.compress(data, ZLIB_LEVEL)
+    return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def _decompress(codec, blob):
+    if codec == "zlib":
+        return zlib.decompress(blob)
+    if codec == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("This page store holds zstd pages, install zstandard to read them")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown page codec {codec!r}")
+
+
+class FileStore:
+    """One .txt file per city in `output_dir`, the layout the pipeline always had."""
+
+    def __init__(self, output_dir=".", pattern=OUTPUT_PATTERN):
+        self.output_dir = output_dir
+        self.pattern = pattern
+
+    def file_path(self, city_name):
+        return output_path_for(city_name, self.output_dir, self.pattern)
+
+    def put(self, city_name, content):
+        """Store a page; returns its location (here the file path)."""
+        path = self.file_path(city_name)
+        write_page(path, content)
+        return path
+
+    def get(self, city_name):
+        return read_page(self.file_path(city_name))
+
+    def location(self, city_name):
+        return self.file_path(city_name)
+
+    def close(self):
+        pass
+
+
+class SQLiteStore:
+    """All pages in one SQLite file, compressed, every write kept as a new version.
+
+    Rows are keyed by (run, city, version): a rerun adds versions instead
+    of overwriting, runs under different names never collide, and reads
+    get the latest version unless asked for another. Each write is a
+    single transaction, so a crash leaves either the old or the new page.
+    Several processes (shards) can write to the same file. Pages are
+    compressed with zstd when `zstandard` is installed, else zlib.
+    """
+
+    def __init__(self, path="pages.sqlite", run="main"):
+        self.path = path
+        self.run = run
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                run TEXT NOT NULL,
+                city TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                codec TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                sha256 TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                body BLOB NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS pages_key ON pages (run, city, version)")
+
+    def file_path(self, city_name):
+        return None  # no file per city; see location()
+
+    def put(self, city_name, content):
+        """Store a page as the city's next version (unless it equals the latest); returns its location."""
+        data = content.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        codec, blob = _compress(data)
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                version, latest = self.conn.execute(
+                    "SELECT version, sha256 FROM pages WHERE run = ? AND city = ? ORDER BY version DESC LIMIT 1",
+                    (self.run, city_name)).fetchone() or (0, None)
+                if latest != digest:
+                    version += 1
+                    self.conn.execute("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                      (self.run, city_name, version, codec, len(data), digest, time.time(), blob))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return self.location(city_name, version)
+
+    def get(self, city_name, version=None, run=None):
+        run = run or self.run
+        with self._lock:
+            if version is None:
+                row = self.conn.execute(
+                    "SELECT codec, body FROM pages WHERE run = ? AND city = ? ORDER BY version DESC LIMIT 1",
+                    (run, city_name)).fetchone()
+            else:
+                row = self.conn.execute("SELECT codec, body FROM pages WHERE run = ? AND city = ? AND version = ?",
+                                        (run, city_name, version)).fetchone()
+        if row is None:
+            raise KeyError(f"No page for {city_name!r} in run {run!r} of {self.path}")
+        return _decompress(*row).decode("utf-8")
+
+    def location(self, city_name, version=None):
+        """A string naming the page, readable with read_location in any process."""
+        location = f"{SQLITE_PREFIX}{self.path}#{quote(self.run, safe='')}/{quote(city_name, safe='')}"
+        return f"{location}/{version}" if version else location
+
+    def versions(self, city_name):
+        with self._lock:
+            return [row[0] for row in self.conn.execute(
+                "SELECT version FROM pages WHERE run = ? AND city = ? ORDER BY version", (self.run, city_name))]
+
+    def close(self):
+        self.conn.close()
+
+
+_readers = {}
+_readers_lock = threading.Lock()
+
+
+def read_location(location):
+    """Page at a location returned by a store's put/location (a file path or an SQLite location)."""
+    if not location.startswith(SQLITE_PREFIX):
+        return read_page(location)
+    path, _, key = location[len(SQLITE_PREFIX):].rpartition("#")
+    run, city_name, *version = [unquote(part) for part in key.split("/")]
+    # connections must not cross a fork, so worker processes open their own
+    with _readers_lock:
+        reader = _readers.get((os.getpid(), path))
+        if reader is None:
+            reader = _readers[(os.getpid(), path)] = SQLiteStore(path, run)
+    return reader.get(city_name, int(version[0]) if version else None, run=run)
+
+
+def open_store(url, output_dir=".", pattern=OUTPUT_PATTERN, run="main"):
+    """FileStore for "" / "files", SQLiteStore for a .sqlite / .db path."""
+    if not url or url == "files":
+        return FileStore(output_dir, pattern)
+    return SQLiteStore(url, run)
@@ -0,0 +1,150 @@
+import string
+from collections import namedtuple
+from functools import lru_cache
+
+from rate_limit import estimate_tokens
+
+# (context window, max output tokens) per model family, longest prefix wins
+MODEL_LIMITS = {
+    "gpt-4.1": (1_047_576, 32_768),
+    "gpt-4o": (128_000, 16_384),
+    "deepseek-chat": (128_000, 8_192),
+}
+# OpenAI caches prompt prefixes of at least 1024 tokens, in steps of 128
+CACHE_MIN_TOKENS = 1024
+CACHE_STEP_TOKENS = 128
+# chat format overhead: a few tokens per message plus the reply primer
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+PromptBudget = namedtuple("PromptBudget", "prompt_tokens cacheable_tokens uncached_tokens max_tokens")
+
+
+class PromptTooLongError(ValueError):
+    """The request would not fit the model's context window or the configured budget."""
+
+
+@lru_cache(maxsize=None)
+def _fallback(reason):
+    # cached, so each reason is printed once per process
+    print(f"⚠️ Counting tokens as chars/4, {reason}; budgets are only estimates")
+
+
+@lru_cache(maxsize=None)
+def _encoding(model):
+    try:
+        import tiktoken
+    except ImportError:
+        _fallback("tiktoken is not installed (pip install tiktoken)")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # no network to fetch the BPE file and nothing cached locally
+        _fallback(f"tiktoken could not load its encoding ({type(e).__name__})")
+        return None
+
+
+def count_tokens(text, model):
+    """Tokens in `text` with the model's tokenizer (tiktoken), else a chars/4 estimate."""
+    encoding = _encoding(model)
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def model_limits(model):
+    for name in sorted(MODEL_LIMITS, key=len, reverse=True):
+        if model == name or model.startswith(name + "-"):
+            return MODEL_LIMITS[name]
+    return None
+
+
+def cacheable(prefix_tokens):
+    """How much of a shared prefix the provider can serve from its prompt cache."""
+    if prefix_tokens < CACHE_MIN_TOKENS:
+        return 0
+    return CACHE_MIN_TOKENS + (prefix_tokens - CACHE_MIN_TOKENS) // CACHE_STEP_TOKENS * CACHE_STEP_TOKENS
+
+
+class CompiledPrompt:
+    """A prompt template parsed once and rendered per city without str.format.
+
+    Providers cache the longest prompt prefix shared between requests, so
+    everything before the first placeholder (plus the system message) is
+    only paid in full once. With `static_first` the user message is laid
+    out as the whole template with placeholders shown as [CITY_NAME] etc.,
+    followed by the values, so the entire template becomes that shared
+    prefix; the wording changes, so cached pages from the plain layout
+    no longer match.
+    """
+
+    def __init__(self, template, sys_msg, static_first=False):
+        self.template = template
+        self.sys_msg = sys_msg
+        self.static_first = static_first
+        self.parts = []
+        self.fields = []
+        for literal, field, spec, conversion in string.Formatter().parse(template):
+            if literal:
+                self.parts.append((True, literal))
+            if field is not None:
+                if spec or conversion or not field.isidentifier():
+                    raise ValueError(f"Only plain {{name}} placeholders are supported, got {field!r}")
+                self.parts.append((False, field))
+                if field not in self.fields:
+                    self.fields.append(field)
+
+        if static_first:
+            body = "".join(text if literal else f"[{text.upper()}]" for literal, text in self.parts)
+            self.prefix = body.rstrip() + "\n\n"
+        else:
+            self.prefix = "".join(text for literal, text in self.parts[:self._first_field()])
+        self._prefix_tokens = {}
+
+    def _first_field(self):
+        for i, (literal, _) in enumerate(self.parts):
+            if not literal:
+                return i
+        return len(self.parts)
+
+    def render(self, **values):
+        if self.static_first:
+            return self.prefix + "\n".join(f"{field.upper()}: {values[field]}" for field in self.fields)
+        return "".join(text if literal else str(values[text]) for literal, text in self.parts)
+
+    def format(self, **values):
+        # drop-in for the str templates callers used to pass around
+        return self.render(**values)
+
+    def prefix_tokens(self, model):
+        """Tokens of the part every request shares: system message and static template prefix."""
+        if model not in self._prefix_tokens:
+            self._prefix_tokens[model] = (count_tokens(self.sys_msg, model) + count_tokens(self.prefix, model)
+                                          + TOKENS_PER_MESSAGE * 2)
+        return self._prefix_tokens[model]
+
+    def budget(self, final_prompt, model, max_tokens, max_prompt_tokens=None):
+        """Pre-flight token count of one request; raises PromptTooLongError if it cannot fit."""
+        prompt_tokens = (self.prefix_tokens(model) + count_tokens(final_prompt[len(self.prefix):], model)
+                         + TOKENS_PER_REPLY)
+        if max_prompt_tokens and prompt_tokens > max_prompt_tokens:
+            raise PromptTooLongError(f"Prompt is {prompt_tokens} tokens, over the budget of {max_prompt_tokens}")
+        limits = model_limits(model)
+        if limits:
+            context, max_output = limits
+            if max_tokens > max_output:
+                raise PromptTooLongError(f"max_tokens {max_tokens} is over {model}'s output limit of {max_output}")
+            if prompt_tokens + max_tokens > context:
+                raise PromptTooLongError(f"Prompt of {prompt_tokens} tokens plus max_tokens {max_tokens} "
+                                         f"is over {model}'s context window of {context}")
+        cached = cacheable(self.prefix_tokens(model))
+        return PromptBudget(prompt_tokens, cached, prompt_tokens - cached, max_tokens)
+
+
+def compile_prompt(template, sys_msg, static_first=False):
+    if isinstance(template, CompiledPrompt):
+        return template
+    return CompiledPrompt(template, sys_msg, static_first)
@@ -0,0 +1,220 @@
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+FAQ_PATTERN = re.compile(r"\bfaqs?\b|frequently asked", re.I)
+FENCE_PATTERN = re.compile(r"^\s*```[a-z]*\s*|\s*```\s*$", re.I)
+OPENING_FENCE = re.compile(r"^\s*```[a-z]*\s*", re.I)
+CLOSING_FENCE = re.compile(r"\s*```\s*$")
+BODY_START = re.compile(r"<body\b[^>]*>", re.I)
+BODY_END = re.compile(r"</body\s*>", re.I)
+HEADINGS = ("h1", "h2", "h3")
+
+Check = namedtuple("Check", "name ok value expected")
+# one part of the page to ask the model for, spliced in at `offset` of the page
+Repair = namedtuple("Repair", "part prompt offset max_tokens")
+PageStats = namedtuple("PageStats", "chars words h1 h2 links faq city_mentions headings")
+
+
+class _PageScanner(HTMLParser):
+    """Collects everything the checks need in one pass over the page."""
+
+    def __init__(self, html):
+        super().__init__(convert_charrefs=True)
+        self.line_starts = [0] + [m.end() for m in re.finditer("\n", html)]
+        self.counts = {"h1": 0, "h2": 0, "h3": 0}
+        self.links = 0
+        self.headings = []  # (tag, text, offset of the start tag)
+        self.text = []
+        self._heading = None
+        self._skip = 0
+
+    def source_offset(self):
+        line, col = self.getpos()
+        return self.line_starts[line - 1] + col
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in HEADINGS:
+            self.counts[tag] += 1
+            self._heading = (tag, [], self.source_offset())
+        elif tag == "a" and dict(attrs).get("href"):
+            self.links += 1
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(0, self._skip - 1)
+        elif tag in HEADINGS and self._heading and self._heading[0] == tag:
+            heading_tag, parts, offset = self._heading
+            self.headings.append((heading_tag, " ".join("".join(parts).split()), offset))
+            self._heading = None
+
+    def handle_data(self, data):
+        if self._skip:
+            return
+        self.text.append(data)
+        if self._heading:
+            self._heading[1].append(data)
+
+
+def scan_page(html, city_name):
+    scanner = _PageScanner(html)
+    scanner.feed(html)
+    scanner.close()
+    text = " ".join(scanner.text)
+    mentions = len(re.findall(r"\b" + re.escape(city_name) + r"\b", text, re.I)) if city_name else 0
+    faq = any(FAQ_PATTERN.search(heading) for _, heading, _ in scanner.headings)
+    return PageStats(len(html), len(text.split()), scanner.counts["h1"], scanner.counts["h2"], scanner.links,
+                     faq, mentions, scanner.headings)
+
+
+class Verdict:
+    """Result of PageValidator.check: every check with its value, and the page stats."""
+
+    def __init__(self, checks, stats, rules):
+        self.checks = checks
+        self.stats = stats
+        self.rules = rules
+
+    @property
+    def ok(self):
+        return all(check.ok for check in self.checks)
+
+    @property
+    def failures(self):
+        return [check for check in self.checks if not check.ok]
+
+    @property
+    def repairable(self):
+        # a page that is mostly missing is cheaper to regenerate than to patch
+        failures = self.failures
+        return (bool(failures) and all(check.name in PageValidator.REPAIRABLE for check in failures)
+                and self.stats.chars >= self.rules.min_chars // 2 and self.stats.h1 + self.stats.h2 > 0)
+
+    def as_dict(self):
+        return {"ok": self.ok, "failures": [check._asdict() for check in self.failures],
+                "stats": {field: value for field, value in self.stats._asdict().items() if field != "headings"}}
+
+    def __str__(self):
+        if self.ok:
+            return "ok"
+        return "; ".join(f"{check.name} is {check.value}, expected {check.expected}" for check in self.failures)
+
+
+def strip_fences(fragment):
+    return FENCE_PATTERN.sub("", fragment or "").strip()
+
+
+def content_bounds(html):
+    """(start, end) offsets of the page content: inside <body>, else inside a ```html fence, else all of it.
+
+    Parts spliced outside these would land before the doctype or after
+    </html> or the fence, where the Docs stage never looks.
+    """
+    start, end = 0, len(html)
+    opening = OPENING_FENCE.match(html)
+    if opening:
+        start = opening.end()
+        closing = CLOSING_FENCE.search(html, start)
+        end = closing.start() if closing else end
+    body = BODY_START.search(html, start, end)
+    if body:
+        start = body.end()
+        closing = BODY_END.search(html, start, end)
+        end = closing.start() if closing else end
+    return start, end
+
+
+class PageValidator:
+    """Checks a generated page's structure instead of only its length.
+
+    Checks run on one HTMLParser pass: length, exactly `h1` <h1> headings,
+    at least `min_h2` <h2> sections, an FAQ heading, at least `min_links`
+    links and the city named `city_density` (min, max) times per 100 words.
+    When only the h1, the sections, the length or the FAQ fail, `plan`
+    returns small requests for just those parts, which `apply` splices
+    into the page, so a nearly good page is not paid for twice.
+    """
+
+    REPAIRABLE = ("length", "h1", "h2", "faq")
+
+    def __init__(self, min_chars=5000, h1=1, min_h2=3, require_faq=True, min_links=0, city_density=(0.2, 5.0)):
+        self.min_chars = min_chars
+        self.h1 = h1
+        self.min_h2 = min_h2
+        self.require_faq = require_faq
+        self.min_links = min_links
+        self.city_density = city_density
+
+    def check(self, html, city_name=None):
+        stats = scan_page(html, city_name)
+        checks = [
+            Check("length", stats.chars >= self.min_chars, stats.chars, f">= {self.min_chars}"),
+            Check("h1", stats.h1 == self.h1, stats.h1, f"== {self.h1}"),
+            Check("h2", stats.h2 >= self.min_h2, stats.h2, f">= {self.min_h2}"),
+        ]
+        if self.require_faq:
+            checks.append(Check("faq", stats.faq, stats.faq, True))
+        if self.min_links:
+            checks.append(Check("links", stats.links >= self.min_links, stats.links, f">= {self.min_links}"))
+        if city_name and self.city_density:
+            low, high = self.city_density
+            density = round(100 * stats.city_mentions / max(stats.words, 1), 2)
+            checks.append(Check("city_density", (low is None or density >= low) and (high is None or density <= high),
+                                density, f"{low}..{high} per 100 words"))
+        return Verdict(checks, stats, self)
+
+    def plan(self, html, verdict, city_name, country_name):
+        """(page, repairs) for a repairable verdict; extra <h1>s are demoted to <h2> in place."""
+        stats = verdict.stats
+        failed = {check.name for check in verdict.failures}
+        if stats.h1 > self.h1:
+            html = demote_extra_h1(html, self.h1)
+            stats = scan_page(html, city_name)
+
+        outline = "\n".join(f"- {text}" for tag, text, _ in stats.headings if tag != "h3")
+        context = (f"A landing page for {city_name}, {country_name} has these headings:\n{outline}\n\n"
+                   "Answer with the HTML fragment only, no <html>/<body> wrapper and no commentary.")
+        start, end = content_bounds(html)
+        faq_offset = next((offset for _, text, offset in stats.headings if FAQ_PATTERN.search(text)), end)
+        repairs = []
+        if stats.h1 < self.h1:
+            repairs.append(Repair("h1", f"{context}\n\nWrite the page's single <h1> heading.", start, 100))
+        missing_sections = max(self.min_h2 - stats.h2, 0)
+        if "length" in failed:
+            # ~1500 characters per extra section
+            missing_sections = max(missing_sections, -(-(self.min_chars - stats.chars) // 1500))
+        if missing_sections:
+            repairs.append(Repair(
+                "h2", f"{context}\n\nWrite {missing_sections} more <h2> section(s) with paragraphs on topics the "
+                      f"headings above do not cover yet, about {1500 * missing_sections} characters in total.",
+                faq_offset, 600 * missing_sections))
+        if "faq" in failed:
+            repairs.append(Repair(
+                "faq", f"{context}\n\nWrite an FAQ section: an <h2>Frequently Asked Questions</h2> followed by "
+                       "4 to 6 questions as <h3> each with a <p> answer.",
+                end, 900))
+        return html, repairs
+
+    def apply(self, html, repairs, fragments):
+        # splice from the end so earlier offsets stay valid; at the same offset
+        # the later repair goes in first, so new sections end up before the FAQ
+        spliced = sorted(enumerate(zip(repairs, fragments)), key=lambda item: (item[1][0].offset, item[0]), reverse=True)
+        for _, (repair, fragment) in spliced:
+            fragment = strip_fences(fragment)
+            html = html[:repair.offset] + fragment + "\n" + html[repair.offset:]
+        return html
+
+
+def demote_extra_h1(html, keep=1):
+    count = 0
+
+    def demote(match):
+        nonlocal count
+        if match.group(1) == "":
+            count += 1
+        return match.group(0) if count <= keep else "<" + match.group(1) + "h2"
+
+    # <h1 ...> and </h1> keep their length as <h2 / </h2, so offsets do not move
+    return re.sub(r"<(/?)h1\b", demote, html, flags=re.I)
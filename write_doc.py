@@ -1,18 +1,64 @@
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+import json
+import os
 import re
-from content import html2, mdc
+import threading
+from retry import default_policy
 
 
 SERVICE_ACCOUNT_FILE = "doc-reader.json"
 SCOPES = ["https://www.googleapis.com/auth/documents"]
+# local copy of the Docs API discovery document, so building a client
+# never has to fetch it again
+DISCOVERY_CACHE = "docs_discovery_v1.json"
+DISCOVERY_URL = "https://docs.googleapis.com/$discovery/rest?version=v1"
+
+# longest single insertText, kept well under the Docs API payload limits
+MAX_INSERT_CHARS = 100_000
+
+
+_credentials = None
+_discovery_doc = None
+_service = None
+_lock = threading.Lock()
+
+
+def load_discovery_doc(path=DISCOVERY_CACHE):
+    global _discovery_doc
+    with _lock:
+        if _discovery_doc is None:
+            if os.path.exists(path):
+                with open(path, encoding="utf-8") as f:
+                    _discovery_doc = f.read()
+            else:
+                import urllib.request  # pulls in ssl; only needed once, the document is cached below
+                with urllib.request.urlopen(DISCOVERY_URL, timeout=30) as r:
+                    _discovery_doc = r.read().decode("utf-8")
+                json.loads(_discovery_doc)  # don't cache an error page
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(_discovery_doc)
+        return _discovery_doc
+
+
+def build_docs_service():
+    """A new Docs client with its own HTTP connection (httplib2 is not thread-safe)."""
+    # the Google client libraries take a few hundred ms to import, so only the Docs stage pays for them
+    from google.oauth2.service_account import Credentials
+    from googleapiclient.discovery import build_from_document
+
+    global _credentials
+    with _lock:
+        if _credentials is None:
+            _credentials = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
+    return build_from_document(load_discovery_doc(), credentials=_credentials)
 
 
 def auth_docs():
-    creds = Credentials.from_service_account_file(SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    service = build("docs", "v1", credentials=creds)
-    return service
+    # one shared client for single-threaded callers
+    global _service
+    if _service is None:
+        _service = build_docs_service()
+    return _service
 
 
 def clean_text(s):
@@ -21,295 +67,394 @@ def clean_text(s):
 
 
 tab_id = 't.8sh23tb4aixw'
-def build_requests_from_html(html, starting_index=1, tab_id=tab_id):
-    soup = BeautifulSoup(html, "html.parser")
-    body = soup.find("body")
-    if body is None:
-        body = soup  # fallback
-
-    requests = []
-    pending_styles = []
-    # Simulating the document's character index while building the requests.
-    current_index = starting_index
-
-    # helper to insert text at current_index and increment
-    def insert_text_and_advance(text):
-        nonlocal current_index, requests
+
+HEADING_STYLES = {"h1": "HEADING_1", "h2": "HEADING_2", "h3": "HEADING_3", "h4": "HEADING_4"}
+BULLET_PRESETS = {"ul": "BULLET_DISC_CIRCLE_SQUARE", "ol": "NUMBERED_DECIMAL_ALPHA_ROMAN"}
+# tags that never get an end tag, closed as soon as they open (same list as BeautifulSoup)
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input", "keygen", "link", "menuitem", "meta",
+    "param", "source", "track", "wbr", "basefont", "bgsound", "command", "frame", "image", "isindex",
+    "nextid", "spacer",
+}
+# text inside these is not part of the visible text of the tags around them
+STRING_CONTAINERS = {"script", "style", "template", "rt", "rp"}
+
+# kinds of text the parser hands to the converter; text inside a string
+# container is tagged with the container's name instead
+TEXT, CDATA, SPECIAL = "text", "cdata", "special"
+
+
+class DocsRequestWriter:
+    """Turns the top-level blocks of one container into Docs API requests.
+
+    Keeps the simulated document index while requests are emitted; text
+    styles are held back and appended after each ordered list and at the
+    end so they are never inherited by later inserts.
+    """
+
+    def __init__(self, depth, starting_index, tab_id):
+        self.depth = depth  # nesting depth of the container's direct children
+        self.tab_id = tab_id
+        self.requests = []
+        self.pending_styles = []
+        # Simulating the document's character index while building the requests.
+        self.current_index = starting_index
+        self.block = None
+        self.child = None
+
+    def insert_text_and_advance(self, text):
         if not text:
             return (None, None)
         # ensure text uses normalized newlines
         text = text.replace('\r\n', '\n')
-        req = {"insertText": {"location": {"tabId": tab_id, "index": current_index}, "text": text}}
-        requests.append(req)
-        start = current_index
-        current_index += len(text)
-        end = current_index
-        return start, end
-
-    # collecting style requests as we go (they depend on start/end indices we've just recorded)
-    def add_text_style(start, end, style_dict):
-        # fields is comma-separated keys of style_dict
+        self.requests.append({"insertText": {"location": {"tabId": self.tab_id, "index": self.current_index}, "text": text}})
+        start = self.current_index
+        self.current_index += len(text)
+        return start, self.current_index
+
+    def add_text_style(self, start, end, style_dict):
         if start is None or end is None or start == end:
             return
-        
-        fields = ",".join(style_dict.keys())
-        pending_styles.append({
+        self.pending_styles.append({
             "updateTextStyle": {
-                "range": {"startIndex": start, "endIndex": end, "tabId": tab_id},
+                "range": {"startIndex": start, "endIndex": end, "tabId": self.tab_id},
                 "textStyle": style_dict,
-                "fields": fields
+                "fields": ",".join(style_dict.keys())
             }
         })
 
-    def add_paragraph_style(start, end, named_style):
+    def add_paragraph_style(self, start, end, named_style):
         if start is None or end is None or start == end:
             return
-        requests.append({
+        self.requests.append({
             "updateParagraphStyle": {
-                "range": {"startIndex": start, "endIndex": end, "tabId": tab_id},
+                "range": {"startIndex": start, "endIndex": end, "tabId": self.tab_id},
                 "paragraphStyle": {"namedStyleType": named_style},
                 "fields": "namedStyleType"
             }
         })
 
-    def maybe_add_space():
-        # Insert a space only if the previous character is not a space or newline
-        nonlocal current_index, requests
-        if current_index > 1:
-            requests.append({
-                "insertText": {
-                    "location": {"tabId": tab_id, "index": current_index},
-                    "text": " "
-                }
-            })
-            current_index += 1
-
-    # Walk direct children of body to keep structure order
-    for node in body.children:
-        if isinstance(node, str):
-            text = clean_text(node)
-            if text:
-                insert_text_and_advance(text + "\n")
-            continue
+    def add_space(self):
+        self.requests.append({"insertText": {"location": {"tabId": self.tab_id, "index": self.current_index}, "text": " "}})
+        self.current_index += 1
+
+    def maybe_add_space(self):
+        if self.current_index > 1:
+            self.add_space()
+
+    def flush_styles(self):
+        self.requests.extend(self.pending_styles)
+        self.pending_styles = []
+
+    # --- events from HtmlToDocsParser; depth = number of open ancestors ---
+
+    def start(self, tag, attrs, depth):
+        block = self.block
+        if block is None:
+            if depth != self.depth:
+                return
+            if tag in HEADING_STYLES:
+                self.block = {"tag": tag, "parts": []}
+            elif tag == "p":
+                self.block = {"tag": tag, "start": self.current_index, "prev_was_text": False}
+            elif tag in BULLET_PRESETS:
+                self.block = {"tag": tag, "first": None, "last": None, "li_start": None}
+            return
+
+        if block["tag"] == "p":
+            if depth == self.depth + 1:
+                self.child = {"tag": tag, "href": attrs.get("href") if tag == "a" else None, "parts": []}
+        elif block["tag"] in BULLET_PRESETS:
+            if depth == self.depth + 1 and tag == "li":
+                block["li_start"] = self.current_index
+            elif depth == self.depth + 2 and block["li_start"] is not None:
+                self.child = {"tag": tag, "href": attrs.get("href") if tag == "a" else None, "parts": []}
+
+    def string(self, text, kind, depth):
+        block = self.block
+        if block is None:
+            if depth == self.depth:
+                text = clean_text(text)
+                if text:
+                    self.insert_text_and_advance(text + "\n")
+            return
 
-        name = getattr(node, "name", "").lower()
-
-        if name in ("h1", "h2", "h3", "h4"):
-            text = clean_text(node.get_text())
-            if not text:
-                continue
-            # Insert text + newline
-            start, end = insert_text_and_advance(text + "\n")
-
-            # apply bold ONLY to visible characters
-            add_text_style(start, start + len(text), {"bold": True})
-
-            # Map to named styles
-            if name == "h1":
-                add_paragraph_style(start, end, "HEADING_1")
-            elif name == "h2":
-                add_paragraph_style(start, end, "HEADING_2")
-            elif name == "h3":
-                add_paragraph_style(start, end, "HEADING_3")
-            elif name == "h4":
-                add_paragraph_style(start, end, "HEADING_4")
-        
-            
-        elif name == "p":
-            paragraph_start = current_index
-
-            prev_was_text = False  # track continuity
-
-            for child in node.children:
-                cname = getattr(child, "name", None)
-
-                if cname == "strong":
-                    t = clean_text(child.get_text())
-                    if t:
-                        # Insert space when toggling from plain → strong
-                        if prev_was_text:
-                            maybe_add_space()
-
-                        s, e = insert_text_and_advance(t)
-                        add_text_style(s, e, {"bold": True})
-                        prev_was_text = True
-
-                elif cname == "a":
-                    t = clean_text(child.get_text())
-                    href = child.get("href")
-                    if t:
-                        if prev_was_text:
-                            maybe_add_space()
-
-                        s, e = insert_text_and_advance(t)
-                        if href:
-                            add_text_style(s, e, {"link": {"url": href}})
-                        prev_was_text = True
-
-                else:
-                    plain = child if isinstance(child, str) else child.get_text()
-                    plain = clean_text(plain)
-                    if plain:
-                        if prev_was_text:
-                            maybe_add_space()
-                        insert_text_and_advance(plain)
-                        prev_was_text = True
-
-            _ , paragraph_end = insert_text_and_advance("\n")
-
-            add_paragraph_style(paragraph_start, paragraph_end, "NORMAL_TEXT")
-
-
-        elif name == "ul":
-            first_item_index = None
-            last_item_index = None
-
-            for li in node.find_all("li", recursive=False):
-                li_start = current_index
-
-                # Process children inside <li> just like <p> logic
-                for child in li.children:
-                    prev_was_text = False  # track continuity
-
-                    cname = getattr(child, "name", None)
-
-                    if cname == "strong":
-                        t = clean_text(child.get_text())
-                        if t:
-                            if prev_was_text:
-                                maybe_add_space()
-
-                            s, e = insert_text_and_advance(t)
-                            add_text_style(s, e, {"bold": True})
-
-                            # adding a space after the bold cahrecters
-                            requests.append({"insertText": {"location": {"tabId": tab_id, "index": current_index},
-                                                            "text": " "}})
-                            current_index += 1
-
-                            prev_was_text = True
-
-                    elif cname == "a":
-                        t = clean_text(child.get_text())
-                        href = child.get("href")
-                        if t:
-                            if prev_was_text:
-                                maybe_add_space()
-
-                            s, e = insert_text_and_advance(t)
-                            if href:
-                                add_text_style(s, e, {"link": {"url": href}})
-
-                            prev_was_text = True
-
-                    else:
-                        # plain text
-                        plain = child if isinstance(child, str) else child.get_text()
-                        plain = clean_text(plain)
-                        if prev_was_text:
-                            maybe_add_space()
-                        s, e = insert_text_and_advance(plain)
-                        add_paragraph_style(s, e, "NORMAL_TEXT")
-                        prev_was_text = True
+        child = self.child
+        if child is not None:
+            # same strings as Tag.get_text() of the child
+            if child["tag"] in STRING_CONTAINERS:
+                wanted = kind == child["tag"]
+            else:
+                wanted = kind in (TEXT, CDATA)
+            if wanted:
+                child["parts"].append(text)
+        elif block["tag"] in HEADING_STYLES:
+            if kind in (TEXT, CDATA):
+                block["parts"].append(text)
+        elif block["tag"] == "p":
+            if depth == self.depth + 1:
+                self.paragraph_child(None, text, None)
+        elif block["tag"] in BULLET_PRESETS:
+            if depth == self.depth + 2 and block["li_start"] is not None:
+                self.list_item_child(None, text, None)
+
+    def end(self, tag, depth):
+        block = self.block
+        if block is None:
+            return
+        name = block["tag"]
+
+        if depth == self.depth:
+            self.block = None
+            if name in HEADING_STYLES:
+                self.heading(name, "".join(block["parts"]))
+            elif name == "p":
+                _, paragraph_end = self.insert_text_and_advance("\n")
+                self.add_paragraph_style(block["start"], paragraph_end, "NORMAL_TEXT")
+            else:
+                if block["first"] is not None:
+                    self.requests.append({
+                        "createParagraphBullets": {
+                            "range": {"startIndex": block["first"], "endIndex": block["last"], "tabId": self.tab_id},
+                            "bulletPreset": BULLET_PRESETS[name]
+                        }
+                    })
+                if name == "ol":
+                    self.flush_styles()
+            return
 
+        child = self.child
+        if name == "p" and depth == self.depth + 1 and child is not None:
+            self.child = None
+            self.paragraph_child(child["tag"], "".join(child["parts"]), child["href"])
+        elif name in BULLET_PRESETS and block["li_start"] is not None:
+            if depth == self.depth + 2 and child is not None:
+                self.child = None
+                self.list_item_child(child["tag"], "".join(child["parts"]), child["href"])
+            elif depth == self.depth + 1:
                 # End of LI → add newline
-                li_end = insert_text_and_advance("\n")[1]
-
-                # Track bullet range
-                if first_item_index is None:
-                    first_item_index = li_start
-                last_item_index = li_end
-
-            # Apply bullets to the whole UL
-            if first_item_index is not None:
-                requests.append({
-                    "createParagraphBullets": {
-                        "range": {"startIndex": first_item_index, "endIndex": last_item_index, "tabId": tab_id},
-                        "bulletPreset": "BULLET_DISC_CIRCLE_SQUARE"
-                    }
-                })
-
-
-        elif name == "ol":
-            first_item_index = None
-            last_item_index = None
-
-            for li in node.find_all("li", recursive=False):
-                li_start = current_index
-
-                # Process children inside <li> just like <p> logic
-                for child in li.children:
-                    prev_was_text = False  # track continuity
-
-                    cname = getattr(child, "name", None)
-
-                    if cname == "strong":
-                        t = clean_text(child.get_text())
-                        if t:
-                            if prev_was_text:
-                                maybe_add_space()
-
-                            s, e = insert_text_and_advance(t)
-                            add_text_style(s, e, {"bold": True})
-                            
-                            # adding a space after the bold cahrecters
-                            requests.append({"insertText": {"location": {"tabId": tab_id, "index": current_index},
-                                                            "text": " "}})
-                            current_index += 1
-
-                            prev_was_text = True
-
-                    elif cname == "a":
-                        t = clean_text(child.get_text())
-                        href = child.get("href")
-                        if t:
-                            if prev_was_text:
-                                maybe_add_space()
-
-                            s, e = insert_text_and_advance(t)
-                            if href:
-                                add_text_style(s, e, {"link": {"url": href}})
-
-                            prev_was_text = True
-
-                    else:
-                        # plain text
-                        plain = child if isinstance(child, str) else child.get_text()
-                        plain = clean_text(plain)
-                        if prev_was_text:
-                            maybe_add_space()
-                        s, e = insert_text_and_advance(plain)
-                        add_paragraph_style(s, e, "NORMAL_TEXT")
-                        prev_was_text = True
+                li_end = self.insert_text_and_advance("\n")[1]
+                if block["first"] is None:
+                    block["first"] = block["li_start"]
+                block["last"] = li_end
+                block["li_start"] = None
 
-                # End of LI → add newline
-                li_end = insert_text_and_advance("\n")[1]
+    # --- request patterns per block type ---
+
+    def heading(self, name, text):
+        text = clean_text(text)
+        if not text:
+            return
+        start, end = self.insert_text_and_advance(text + "\n")
+        # apply bold ONLY to visible characters
+        self.add_text_style(start, start + len(text), {"bold": True})
+        self.add_paragraph_style(start, end, HEADING_STYLES[name])
 
-                # Track bullet range
-                if first_item_index is None:
-                    first_item_index = li_start
-                last_item_index = li_end
+    def paragraph_child(self, tag, text, href):
+        text = clean_text(text)
+        if not text:
+            return
+        block = self.block
+        # Insert space when toggling between plain / strong / link runs
+        if block["prev_was_text"]:
+            self.maybe_add_space()
+        start, end = self.insert_text_and_advance(text)
+        if tag == "strong":
+            self.add_text_style(start, end, {"bold": True})
+        elif tag == "a" and href:
+            self.add_text_style(start, end, {"link": {"url": href}})
+        block["prev_was_text"] = True
+
+    def list_item_child(self, tag, text, href):
+        text = clean_text(text)
+        if tag == "strong":
+            if text:
+                start, end = self.insert_text_and_advance(text)
+                self.add_text_style(start, end, {"bold": True})
+                # adding a space after the bold characters
+                self.add_space()
+        elif tag == "a":
+            if text:
+                start, end = self.insert_text_and_advance(text)
+                if href:
+                    self.add_text_style(start, end, {"link": {"url": href}})
+        else:
+            start, end = self.insert_text_and_advance(text)
+            self.add_paragraph_style(start, end, "NORMAL_TEXT")
+
+    def finish(self):
+        if self.pending_styles:     # remaining styles also apended to the request list
+            self.flush_styles()
+        return self.requests
+
+
+class HtmlToDocsParser(HTMLParser):
+    """Single pass HTML → Google Docs requests converter.
+
+    Walks the markup once with the standard library tokenizer and feeds
+    start / end / text events to a DocsRequestWriter for the direct children
+    of <body> (or of the whole document when there is no body), mirroring
+    how BeautifulSoup's html.parser tree builder nests tags.
+    """
+
+    def __init__(self, starting_index=1, tab_id=tab_id):
+        super().__init__(convert_charrefs=True)
+        self.starting_index = starting_index
+        self.tab_id = tab_id
+        self.stack = []
+        self.text_parts = []
+        self.containers = []  # open string containers, innermost last
+        self.already_closed = {}
+        self.writer = DocsRequestWriter(0, starting_index, tab_id)
+        self.body_writer = None
+        self.body_depth = None  # set once the first <body> opens
+
+    def _flush_text(self):
+        if self.text_parts:
+            text = "".join(self.text_parts)
+            self.text_parts = []
+            self._string(text, self.containers[-1] if self.containers else TEXT)
+
+    def _string(self, text, kind):
+        if self.writer is not None:
+            self.writer.string(text, kind, len(self.stack))
+
+    def _start(self, tag, attrs):
+        depth = len(self.stack)
+        if self.writer is not None:
+            self.writer.start(tag, attrs, depth)
+        if tag == "body" and self.body_depth is None:
+            # only the first body counts; what came before it is discarded
+            self.body_depth = depth
+            self.writer = DocsRequestWriter(depth + 1, self.starting_index, self.tab_id)
+            self.body_writer = self.writer
+
+    def _end(self, tag):
+        depth = len(self.stack)
+        if self.writer is not None:
+            self.writer.end(tag, depth)
+        if tag == "body" and depth == self.body_depth:
+            self.writer = None  # body closed, nothing after it matters
+
+    def _pop(self):
+        tag = self.stack.pop()
+        if tag in STRING_CONTAINERS:
+            self.containers.pop()
+        self._end(tag)
+
+    def _open(self, tag, attrs):
+        self._flush_text()
+        self._start(tag, dict(attrs))
+        self.stack.append(tag)
+        if tag in STRING_CONTAINERS:
+            self.containers.append(tag)
+
+    def _close(self, tag):
+        self._flush_text()
+        if tag not in self.stack:
+            return  # stray end tag
+        while self.stack[-1] != tag:
+            self._pop()
+        self._pop()
+
+    def handle_starttag(self, tag, attrs):
+        self._open(tag, attrs)
+        if tag in VOID_TAGS:
+            self._close(tag)
+            # an explicit </br> for it later on is ignored
+            self.already_closed[tag] = self.already_closed.get(tag, 0) + 1
+
+    def handle_startendtag(self, tag, attrs):
+        self._open(tag, attrs)
+        self._close(tag)
+
+    def handle_endtag(self, tag):
+        if self.already_closed.get(tag):
+            self.already_closed[tag] -= 1
+            return
+        self._close(tag)
+
+    def handle_data(self, data):
+        self.text_parts.append(data)
+
+    def _special(self, text, kind=SPECIAL):
+        self._flush_text()
+        self._string(text, kind)
 
-            # Apply bullets to the whole UL
-            if first_item_index is not None:
-                requests.append({
-                    "createParagraphBullets": {
-                        "range": {"startIndex": first_item_index, "endIndex": last_item_index, "tabId": tab_id},
-                        "bulletPreset": "NUMBERED_DECIMAL_ALPHA_ROMAN"
-                    }
-                })
+    def handle_comment(self, data):
+        self._special(data)
 
-            requests.extend(pending_styles)
-            pending_styles = []
+    def handle_decl(self, decl):
+        self._special(decl[len("DOCTYPE "):])
 
-    if pending_styles:     # remaining styles also apended to the request list
-        requests.extend(pending_styles)
-        pending_styles = []
+    def handle_pi(self, data):
+        self._special(data)
 
-    return requests
+    def unknown_decl(self, data):
+        if data.upper().startswith("CDATA["):
+            self._special(data[len("CDATA["):], CDATA)
+        else:
+            self._special(data)
+
+    def close(self):
+        super().close()
+        self._flush_text()
+        while self.stack:
+            self._pop()
+
+    def result(self):
+        writer = self.body_writer if self.body_depth is not None else self.writer
+        return writer.finish()
+
+
+def build_requests_from_html(html, starting_index=1, tab_id=tab_id):
+    parser = HtmlToDocsParser(starting_index, tab_id)
+    parser.feed(html)
+    parser.close()
+    return parser.result()
+
+
+def coalesce_requests(requests):
+    """Merge the per-fragment insertText requests into one insert per tab.
+
+    build_requests_from_html appends every fragment (and every separating
+    space) at the running end of the text, so the inserts join into one
+    contiguous string. All style / paragraph / bullet requests already use
+    final indices, so they are kept in order after the insert. If the
+    inserts are not contiguous the list is returned unchanged.
+    """
+    inserts = {}
+    others = []
+    for req in requests:
+        insert = req.get("insertText")
+        if insert is None:
+            others.append(req)
+            continue
+        location = insert["location"]
+        tab = location.get("tabId")
+        if tab not in inserts:
+            inserts[tab] = {"start": location["index"], "end": location["index"], "parts": []}
+        merged = inserts[tab]
+        if location["index"] != merged["end"]:
+            return requests
+        merged["parts"].append(insert["text"])
+        merged["end"] += len(insert["text"])
+
+    coalesced = []
+    for tab, merged in inserts.items():
+        text = "".join(merged["parts"])
+        # very long pages still go in a few large pieces, one after another
+        for offset in range(0, len(text), MAX_INSERT_CHARS):
+            location = {"index": merged["start"] + offset}
+            if tab is not None:
+                location = {"tabId": tab, "index": merged["start"] + offset}
+            coalesced.append({"insertText": {"location": location, "text": text[offset:offset + MAX_INSERT_CHARS]}})
+    return coalesced + others
 
 
 def main():
+    from content import html2
+
     docs_service = auth_docs()
     # Create a new Google Doc
     # doc = docs_service.documents().create(body={"title": DOCUMENT_TITLE}).execute()
@@ -324,9 +469,10 @@ def main():
         print("No requests generated.")
         return
 
-    # Send batchUpdate
-    batch = {"requests": requests}
-    res = docs_service.documents().batchUpdate(documentId=doc_id, body=batch).execute()
+    # Send batchUpdate: one text insert plus styles
+    batch = {"requests": coalesce_requests(requests)}
+    res = default_policy.call(docs_service.documents().batchUpdate(documentId=doc_id, body=batch).execute,
+                              endpoint="docs")
     print("Batch update executed.")
     # print("Response summary keys:", list(res.keys()))
     print("Open the doc in Google Drive to review formatting.")